@@ -0,0 +1,85 @@
+"""
+Admission control for PDF generation
+"""
+
+# Standard library imports
+import threading
+from typing import Callable, Iterable, Iterator
+
+# Third-party imports
+from django.conf import settings
+
+
+class AdmissionController:
+    """
+    Cap the generations running at once in this process
+
+    A request that cannot get a slot within the bounded wait is turned
+    away, so an overloaded server answers quickly instead of queuing work
+    it cannot finish.
+    """
+
+    def __init__(self, limit: int, wait: float):
+        self.limit = limit
+        self.wait = wait
+        self._slots = threading.BoundedSemaphore(limit)
+
+    def acquire(self) -> bool:
+        """Wait up to the bounded wait for a slot; False when none freed up"""
+        return self._slots.acquire(timeout=self.wait)
+
+    def release(self):
+        """Give a slot back"""
+        self._slots.release()
+
+    def release_after(self, iterator: Iterable) -> '_HeldSlot':
+        """Hold the slot until a streamed body is fully sent or closed"""
+        return _HeldSlot(iterator, self.release)
+
+
+class _HeldSlot:
+    """
+    Iterator that gives its slot back when exhausted or closed
+
+    Django closes a streaming response even when the client left before
+    the body started, which a generator's finally block would miss.
+    """
+
+    def __init__(self, iterator: Iterable, release: Callable):
+        self._iterator = iter(iterator)
+        self._release = release
+        self._released = False
+
+    def __iter__(self) -> Iterator:
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._iterator)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if hasattr(self._iterator, 'close'):
+            self._iterator.close()
+        if not self._released:
+            self._released = True
+            self._release()
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller() -> AdmissionController:
+    """Return the process-wide controller"""
+    global _controller
+
+    with _controller_lock:
+        if _controller is None:
+            _controller = AdmissionController(
+                settings.PAYROLL_MAX_CONCURRENT_GENERATIONS,
+                settings.PAYROLL_ADMISSION_WAIT,
+            )
+        return _controller
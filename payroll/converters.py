@@ -0,0 +1,325 @@
+"""
+DOCX to PDF converters
+"""
+
+# Standard library imports
+import atexit
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+# Third-party imports
+from django.conf import settings
+
+# Local application imports
+from .metrics import span
+from .pdf import PdfDocument
+
+
+class SubprocessConverter:
+    """Convert documents by starting one headless LibreOffice per call"""
+
+    def convert(self, docx_path: str, pdf_path: str):
+        """
+        Convert a DOCX file to PDF
+
+        Args:
+            docx_path: Source DOCX file
+            pdf_path: Destination PDF file
+        """
+        self.convert_many([(docx_path, pdf_path)])
+
+    def convert_many(self, jobs: List[Tuple[str, str]]):
+        """
+        Convert several DOCX files with a single LibreOffice invocation
+
+        Args:
+            jobs: List of (docx_path, pdf_path) pairs. Source file names
+                must be unique, since LibreOffice names each output after
+                its source.
+        """
+        if not jobs:
+            return
+
+        stems = [os.path.splitext(os.path.basename(docx_path))[0] for docx_path, _ in jobs]
+        if len(set(stems)) != len(stems):
+            raise ValueError("Batch conversion needs unique source file names")
+
+        output_dir = os.path.dirname(jobs[0][1]) or '.'
+        # LibreOffice hands a conversion to any instance already running on
+        # the same profile, so every call gets its own, removed afterwards
+        with tempfile.TemporaryDirectory(prefix='payroll-office-') as profile_dir, \
+                tempfile.TemporaryDirectory(dir=output_dir) as batch_dir:
+            result = subprocess.run(
+                [settings.PAYROLL_LIBREOFFICE_BIN, '--headless',
+                 f'-env:UserInstallation=file://{profile_dir}',
+                 '--convert-to', 'pdf', '--outdir', batch_dir] + [docx_path for docx_path, _ in jobs],
+                capture_output=True,
+                text=True
+            )
+
+            if result.returncode != 0:
+                raise RuntimeError(f"PDF conversion failed: {result.stderr}")
+
+            for stem, (_, pdf_path) in zip(stems, jobs):
+                temp_pdf_path = os.path.join(batch_dir, f'{stem}.pdf')
+                if not os.path.exists(temp_pdf_path):
+                    raise FileNotFoundError(f"PDF not created: {temp_pdf_path}")
+                shutil.move(temp_pdf_path, pdf_path)
+
+
+class FakeConverter:
+    """
+    Write a one-page placeholder PDF instead of converting
+
+    Lets benchmarks and development run where LibreOffice is not
+    installed; the PDFs do not show the stub.
+    """
+
+    def convert(self, docx_path: str, pdf_path: str):
+        """Write the placeholder for one DOCX file"""
+        document = PdfDocument()
+        document.add_page(612, 792).text(72, 720, os.path.basename(docx_path), 10)
+        with open(pdf_path, 'wb') as pdf_file:
+            pdf_file.write(document.to_bytes())
+
+    def convert_many(self, jobs: List[Tuple[str, str]]):
+        """Write the placeholder for every (docx_path, pdf_path) pair"""
+        for docx_path, pdf_path in jobs:
+            self.convert(docx_path, pdf_path)
+
+
+class OfficeWorker:
+    """A resident headless LibreOffice listening on a private UNO pipe"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.pipe_name = None
+        self.starts = 0
+        self.process = None
+        self.desktop = None
+        self.profile_dir = None
+        self.jobs = 0
+
+    def start(self):
+        """Start the office process and connect to it"""
+        # Named after this process, the worker and the restart, so no other
+        # process or earlier office can answer on it
+        self.starts += 1
+        self.pipe_name = f'payroll-office-{os.getpid()}-{self.index}-{self.starts}'
+        self.profile_dir = tempfile.mkdtemp(prefix='payroll-office-')
+        try:
+            self.process = subprocess.Popen(
+                [settings.PAYROLL_LIBREOFFICE_BIN, '--headless', '--invisible',
+                 '--nologo', '--nodefault', '--norestore', '--nolockcheck',
+                 f'-env:UserInstallation=file://{self.profile_dir}',
+                 f'--accept=pipe,name={self.pipe_name};urp;'],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            )
+        except Exception:
+            # e.g. LibreOffice is not installed; every job retries the start
+            self.stop()
+            raise
+        self.desktop = self._connect(time.monotonic() + settings.PAYROLL_CONVERTER_TIMEOUT)
+        self.jobs = 0
+
+    def _connect(self, deadline: float):
+        """Wait for the UNO listener and return its Desktop service"""
+        # python3-uno ships with LibreOffice and is not available from PyPI
+        import uno
+
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext(
+            'com.sun.star.bridge.UnoUrlResolver', local_context
+        )
+        url = f'uno:pipe,name={self.pipe_name};urp;StarOffice.ComponentContext'
+
+        while True:
+            try:
+                context = resolver.resolve(url)
+                break
+            except Exception:
+                if not self.is_alive() or time.monotonic() > deadline:
+                    self.stop()
+                    raise RuntimeError(f"Office worker {self.pipe_name} did not start")
+                time.sleep(0.1)
+
+        return context.ServiceManager.createInstanceWithContext(
+            'com.sun.star.frame.Desktop', context
+        )
+
+    def convert(self, docx_path: str, pdf_path: str):
+        """Load a DOCX file in the resident office and export it as PDF"""
+        import uno
+        from com.sun.star.beans import PropertyValue
+
+        def prop(name, value):
+            value_prop = PropertyValue()
+            value_prop.Name = name
+            value_prop.Value = value
+            return value_prop
+
+        document = self.desktop.loadComponentFromURL(
+            uno.systemPathToFileUrl(os.path.abspath(docx_path)), '_blank', 0,
+            (prop('Hidden', True),)
+        )
+        try:
+            document.storeToURL(
+                uno.systemPathToFileUrl(os.path.abspath(pdf_path)),
+                (prop('FilterName', 'writer_pdf_Export'),)
+            )
+        finally:
+            document.close(True)
+        self.jobs += 1
+
+    def is_alive(self) -> bool:
+        """Check whether the office process is still running"""
+        return self.process is not None and self.process.poll() is None
+
+    def kill(self):
+        """Kill the office process, aborting any job in progress"""
+        if self.is_alive():
+            self.process.kill()
+
+    def stop(self):
+        """Stop the office process and remove its profile"""
+        if self.is_alive():
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+        self.desktop = None
+        if self.profile_dir:
+            shutil.rmtree(self.profile_dir, ignore_errors=True)
+            self.profile_dir = None
+
+
+class ConverterPool:
+    """Pool of resident office workers that take conversion jobs"""
+
+    def __init__(self, size: int, timeout: int, max_jobs: int):
+        self.size = size
+        self.timeout = timeout
+        self.max_jobs = max_jobs
+        self._workers = [OfficeWorker(i) for i in range(size)]
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+        atexit.register(self.stop)
+
+    def start(self):
+        """
+        Start every worker; safe to call more than once
+
+        If one worker fails to start, the ones already started are stopped
+        again, so a later call starts from a clean pool.
+        """
+        with self._lock:
+            if self._started:
+                return
+            started = []
+            try:
+                for worker in self._workers:
+                    worker.start()
+                    started.append(worker)
+            except Exception:
+                for worker in started:
+                    worker.stop()
+                raise
+            for worker in started:
+                self._idle.put(worker)
+            self._started = True
+
+    def stop(self):
+        """Stop every worker"""
+        with self._lock:
+            for worker in self._workers:
+                worker.stop()
+            self._idle = queue.Queue()
+            self._started = False
+
+    def convert(self, docx_path: str, pdf_path: str):
+        """
+        Convert a DOCX file to PDF on the next idle worker
+
+        Workers that crashed, were killed on timeout or reached the job
+        limit are restarted before they take the next job.
+        """
+        self.start()
+        try:
+            with span('converter_wait'):
+                worker = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise RuntimeError("PDF conversion failed: no converter available")
+
+        try:
+            if not worker.is_alive() or worker.jobs >= self.max_jobs:
+                worker.stop()
+                worker.start()
+
+            timer = threading.Timer(self.timeout, worker.kill)
+            timer.start()
+            try:
+                worker.convert(docx_path, pdf_path)
+            except Exception as e:
+                worker.stop()
+                raise RuntimeError(f"PDF conversion failed: {e}")
+            finally:
+                timer.cancel()
+        finally:
+            self._idle.put(worker)
+
+        if not os.path.exists(pdf_path):
+            raise FileNotFoundError(f"PDF not created: {pdf_path}")
+
+    def convert_many(self, jobs: List[Tuple[str, str]]):
+        """Convert several DOCX files, spreading the jobs across all workers"""
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            # Consume the results so the first failure is raised here
+            list(executor.map(lambda job: self.convert(*job), jobs))
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_converter():
+    """Return the converter selected by PAYROLL_CONVERTER"""
+    global _pool, _pool_pid
+
+    if settings.PAYROLL_CONVERTER == 'fake':
+        return FakeConverter()
+    if settings.PAYROLL_CONVERTER != 'pool':
+        return SubprocessConverter()
+
+    with _pool_lock:
+        # A forked child gets its own workers; the parent's belong to the parent
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ConverterPool(
+                size=settings.PAYROLL_CONVERTER_POOL_SIZE,
+                timeout=settings.PAYROLL_CONVERTER_TIMEOUT,
+                max_jobs=settings.PAYROLL_CONVERTER_MAX_JOBS,
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def prewarm():
+    """
+    Start the pool's office workers in the background
+
+    Called from the WSGI and ASGI entry points only, so management
+    commands and the runserver reloader never start offices.
+    """
+    if settings.PAYROLL_CONVERTER == 'pool' and settings.PAYROLL_CONVERTER_PREWARM:
+        threading.Thread(target=get_converter().start, daemon=True).start()
@@ -0,0 +1,186 @@
+"""
+Resident cache of parsed DOCX templates
+"""
+
+# Standard library imports
+import copy
+import os
+import re
+import threading
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+# Third-party imports
+from docx import Document
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+
+PLACEHOLDER_PATTERN = re.compile(r'<<\w+>>')
+
+
+class CompiledTemplate:
+    """
+    A template normalized once, with the location of every placeholder
+
+    Each slot records the index of a run in document order and the
+    template text it holds, so filling a stub only rewrites those runs.
+    """
+
+    def __init__(self, doc: Document, slots: List[Tuple[int, str]]):
+        self.doc = doc
+        self.slots = slots
+
+    @classmethod
+    def compile(cls, doc: Document) -> 'CompiledTemplate':
+        """
+        Index the placeholders of a prepared Document
+
+        The Document should already have the stub formatting applied and
+        every placeholder collapsed into a single run; placeholders that
+        Word split across several runs are not indexed.
+        """
+        slots = [
+            (index, run.text)
+            for index, run in enumerate(doc.element.body.iter(qn('w:r')))
+            if PLACEHOLDER_PATTERN.search(run.text)
+        ]
+        return cls(doc, slots)
+
+    def fill(self, replacements: Dict[str, str]) -> Document:
+        """Return a copy of the template with every placeholder replaced"""
+        doc = copy.deepcopy(self.doc)
+        runs = list(doc.element.body.iter(qn('w:r')))
+        for index, text in self.slots:
+            runs[index].text = PLACEHOLDER_PATTERN.sub(
+                lambda match: replacements.get(match.group(0), match.group(0)), text
+            )
+        return doc
+
+
+class TemplateCache:
+    """
+    Parse each DOCX template once per process and hand out clones
+
+    Entries are keyed by absolute path and remember the file's mtime, so an
+    edited template is re-read on its next use. Any number of templates can
+    be resident at once.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[float, Document]] = {}
+        self._compiled: Dict[Tuple[str, Hashable], Tuple[float, CompiledTemplate]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> Document:
+        """
+        Return the pristine parsed template
+
+        The returned Document is shared and must not be modified; use
+        clone() for a copy that can be filled in.
+        """
+        path = os.path.abspath(path)
+        mtime = os.path.getmtime(path)
+
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+
+        doc = Document(path)
+        with self._lock:
+            self._entries[path] = (mtime, doc)
+        return doc
+
+    def clone(self, path: str) -> Document:
+        """Return a private copy of the template, without re-reading the file"""
+        return copy.deepcopy(self.get(path))
+
+    def compiled(self, path: str, prepare: Optional[Callable] = None,
+                 variant: Hashable = None) -> CompiledTemplate:
+        """
+        Return the compiled form of a template
+
+        Args:
+            path: DOCX template path
+            prepare: Callback that normalizes a fresh clone before it is
+                indexed, e.g. applying the stub cell formatting
+            variant: Distinguishes compilations of one file that use
+                different prepare callbacks
+
+        Returns:
+            The cached CompiledTemplate, rebuilt when the file changes
+        """
+        key = (os.path.abspath(path), variant)
+        mtime = os.path.getmtime(key[0])
+
+        with self._lock:
+            entry = self._compiled.get(key)
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+
+        doc = self.clone(path)
+        if prepare:
+            prepare(doc)
+        compiled = CompiledTemplate.compile(doc)
+        with self._lock:
+            self._compiled[key] = (mtime, compiled)
+        return compiled
+
+    def clear(self):
+        """Drop every cached template"""
+        with self._lock:
+            self._entries.clear()
+            self._compiled.clear()
+
+
+template_cache = TemplateCache()
+
+
+def merge_documents(docs: List[Document]) -> Document:
+    """
+    Append the bodies of several documents to the first one
+
+    Each document after the first starts on a new page. Section properties
+    are kept, so multi-column layouts survive; the documents must come from
+    the same template, since styles and relationships are taken from the
+    first one.
+
+    Returns:
+        The first document, holding every body in order
+    """
+    merged = docs[0]
+    body = merged.element.body
+
+    for doc in docs[1:]:
+        # End the last section of the body so far with a paragraph-level
+        # copy of its properties, as Word does for a section break
+        body_sect_pr = body.find(qn('w:sectPr'))
+        paragraph = OxmlElement('w:p')
+        paragraph_pr = OxmlElement('w:pPr')
+        paragraph_pr.append(copy.deepcopy(body_sect_pr))
+        paragraph.append(paragraph_pr)
+        body_sect_pr.addprevious(paragraph)
+
+        elements = [
+            copy.deepcopy(element) for element in doc.element.body
+            if element.tag != qn('w:sectPr')
+        ]
+        first_sect_pr = next(
+            (sect_pr for element in elements for sect_pr in element.iter(qn('w:sectPr'))),
+            None
+        )
+        # The first section of the appended document starts a new page
+        _set_section_start(first_sect_pr if first_sect_pr is not None else body_sect_pr)
+
+        for element in elements:
+            body_sect_pr.addprevious(element)
+
+    return merged
+
+
+def _set_section_start(sect_pr, start: str = 'nextPage'):
+    """Set how a section starts relative to the previous one"""
+    section_type = sect_pr.find(qn('w:type'))
+    if section_type is None:
+        section_type = OxmlElement('w:type')
+        sect_pr.insert(0, section_type)
+    section_type.set(qn('w:val'), start)
@@ -0,0 +1,114 @@
+"""
+Number formatting for the stubs: amounts in words and currency strings
+"""
+
+# Standard library imports
+from typing import Dict, Iterable, List
+
+NUMBER_WORDS = {
+    0: "ZERO", 1: "ONE", 2: "TWO", 3: "THREE", 4: "FOUR", 5: "FIVE",
+    6: "SIX", 7: "SEVEN", 8: "EIGHT", 9: "NINE", 10: "TEN",
+    11: "ELEVEN", 12: "TWELVE", 13: "THIRTEEN", 14: "FOURTEEN", 15: "FIFTEEN",
+    16: "SIXTEEN", 17: "SEVENTEEN", 18: "EIGHTEEN", 19: "NINETEEN",
+    20: "TWENTY", 30: "THIRTY", 40: "FORTY", 50: "FIFTY",
+    60: "SIXTY", 70: "SEVENTY", 80: "EIGHTY", 90: "NINETY"
+}
+
+HUNDREDS_WORDS = {
+    100: "HUNDRED",
+    1000: "THOUSAND"
+}
+
+# Larger numbers are read in groups of these, largest first
+SCALE_WORDS = [
+    (1_000_000_000, "BILLION"),
+    (1_000_000, "MILLION"),
+    (1000, "THOUSAND"),
+]
+
+
+def _build_words(limit: int) -> List[str]:
+    """Spell out every number below limit, reusing the shorter ones"""
+    words = []
+    for num in range(limit):
+        if num < 20:
+            text = NUMBER_WORDS[num]
+        elif num < 100:
+            tens, ones = num // 10 * 10, num % 10
+            text = NUMBER_WORDS[tens] if ones == 0 else f"{NUMBER_WORDS[tens]} {NUMBER_WORDS[ones]}"
+        elif num < 1000:
+            hundreds, remainder = divmod(num, 100)
+            text = f"{NUMBER_WORDS[hundreds]} {HUNDREDS_WORDS[100]}"
+            if remainder:
+                text = f"{text} AND {words[remainder]}"
+        else:
+            thousands, remainder = divmod(num, 1000)
+            text = f"{NUMBER_WORDS[thousands]} {HUNDREDS_WORDS[1000]}"
+            if remainder:
+                text = f"{text} {words[remainder]}"
+        words.append(text)
+    return words
+
+
+# 0-9999, the amounts a stub usually spells out
+WORDS = _build_words(10000)
+
+
+def number_to_words(num: int) -> str:
+    """
+    Convert a whole number to words in English
+
+    Numbers up to 9999 come straight from the table; larger ones are
+    read in groups of thousands, millions and billions.
+
+    Raises:
+        ValueError: For negative numbers
+    """
+    if num < 0:
+        raise ValueError(f"Cannot spell out a negative number: {num}")
+    if num < len(WORDS):
+        return WORDS[num]
+
+    parts = []
+    for scale, name in SCALE_WORDS:
+        if num >= scale:
+            count, num = divmod(num, scale)
+            parts.append(f"{number_to_words(count)} {name}")
+    if num:
+        parts.append(WORDS[num])
+    return ' '.join(parts)
+
+
+def format_cents(cents: int) -> str:
+    """Format integer cents as currency with commas and 2 decimals"""
+    sign = '-' if cents < 0 else ''
+    dollars, remainder = divmod(abs(cents), 100)
+    return f"{sign}{dollars:,}.{remainder:02d}"
+
+
+def decimal_part(cents: int) -> str:
+    """The two cent digits of an amount in integer cents"""
+    return f"{abs(cents) % 100:02d}"
+
+
+def format_cents_many(column: Iterable[int]) -> List[str]:
+    """
+    Format a whole column of amounts at once
+
+    Values repeat a lot across stubs and rows, so each distinct amount is
+    formatted only once.
+
+    Args:
+        column: Amounts in integer cents
+
+    Returns:
+        The currency strings, in the same order
+    """
+    formatted: Dict[int, str] = {}
+    result = []
+    for cents in column:
+        text = formatted.get(cents)
+        if text is None:
+            text = formatted[cents] = format_cents(cents)
+        result.append(text)
+    return result
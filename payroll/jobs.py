@@ -0,0 +1,97 @@
+"""
+Database-backed queue of stub generation jobs
+"""
+
+# Standard library imports
+import os
+from datetime import timedelta
+from typing import Optional
+
+# Third-party imports
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+# Local application imports
+from .models import GenerationJob
+from .views import PayrollCalculator, PayrollDocumentGenerator
+
+
+def claim_next_job() -> Optional[GenerationJob]:
+    """
+    Mark the oldest queued job as running and return it
+
+    Rows locked by another worker are skipped, so several workers can poll
+    the same table without taking the same job.
+    """
+    with transaction.atomic():
+        job = (
+            GenerationJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=GenerationJob.QUEUED)
+            .order_by('created_at')
+            .first()
+        )
+        if job is None:
+            return None
+
+        job.status = GenerationJob.RUNNING
+        job.started_at = timezone.now()
+        job.save(update_fields=['status', 'started_at'])
+    return job
+
+
+def requeue_stale_jobs() -> int:
+    """
+    Queue again the jobs left running by a worker that died
+
+    Returns:
+        Number of jobs put back in the queue
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.PAYROLL_JOB_STALE_AFTER)
+    return GenerationJob.objects.filter(
+        status=GenerationJob.RUNNING, started_at__lt=cutoff
+    ).update(status=GenerationJob.QUEUED, done=0)
+
+
+def run_job(job: GenerationJob):
+    """Generate the archive, or the single PDF, of a claimed job and record the outcome"""
+    def progress(done: int, total: int):
+        GenerationJob.objects.filter(pk=job.pk).update(done=done, total=total)
+
+    merged = PayrollDocumentGenerator.wants_merged(job.inputs)
+    extension = 'pdf' if merged else 'zip'
+
+    os.makedirs(settings.PAYROLL_JOB_RESULTS_DIR, exist_ok=True)
+    result_path = os.path.join(settings.PAYROLL_JOB_RESULTS_DIR, f'{job.id}.{extension}')
+    partial_path = f'{result_path}.part'
+
+    try:
+        payroll_data = PayrollCalculator.calculate(
+            int(job.inputs['anual']), int(job.inputs['period'])
+        )
+        generator = PayrollDocumentGenerator(job.inputs, payroll_data)
+        job.total = len(generator.get_periods())
+        GenerationJob.objects.filter(pk=job.pk).update(total=job.total)
+
+        with open(partial_path, 'wb') as result:
+            if merged:
+                generator.write_merged_pdf(result, progress)
+            else:
+                generator.write_archive(result, progress)
+        # Only a complete result ever appears under the final name
+        os.replace(partial_path, result_path)
+    except Exception as e:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        job.status = GenerationJob.FAILED
+        job.error = str(e)
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'error', 'finished_at'])
+        return
+
+    job.status = GenerationJob.DONE
+    job.done = job.total
+    job.result_path = result_path
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'done', 'result_path', 'finished_at'])
@@ -0,0 +1,651 @@
+"""
+Pay stub layout for the native PDF backend
+
+The layout is read once from the DOCX template and drawn straight to PDF,
+so stubs can be rendered without an office suite. Only the subset of
+WordprocessingML used by the template is understood: paragraphs with
+indents, spacing, alignment, tab stops and font size/weight, continuous
+multi-column sections, and fixed-grid tables (merged cells, shading,
+borders and floating placement).
+"""
+
+# Standard library imports
+import os
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Third-party imports
+from docx.oxml.ns import qn
+
+# Local application imports
+from .docx_templates import PLACEHOLDER_PATTERN, template_cache
+from .pdf import PdfDocument, PdfPage, text_width
+
+TOKEN_PATTERN = re.compile(r'\t|\n| +|[^ \t\n]+')
+
+TWIPS_PER_POINT = 20
+DEFAULT_FONT_SIZE = 11
+DEFAULT_TAB_STOP = 36
+DEFAULT_CELL_MARGIN = 108 / TWIPS_PER_POINT
+LINE_HEIGHT_FACTOR = 1.15  # Arial ascent + descent
+ASCENT_FACTOR = 0.905
+
+
+def _w(tag: str) -> str:
+    return qn(f'w:{tag}')
+
+
+def _twips(value: Optional[str]) -> float:
+    return int(value) / TWIPS_PER_POINT if value else 0
+
+
+def _is_on(element) -> bool:
+    """Read a WordprocessingML toggle property such as <w:b/>"""
+    return element is not None and element.get(_w('val')) not in ('0', 'false', 'off')
+
+
+def _read_run_props(rpr, props: Dict):
+    if rpr is None:
+        return
+    size = rpr.find(_w('sz'))
+    if size is not None:
+        props['size'] = int(size.get(_w('val'))) / 2
+    bold = rpr.find(_w('b'))
+    if bold is not None:
+        props['bold'] = _is_on(bold)
+
+
+def _read_paragraph_props(ppr, props: Dict):
+    if ppr is None:
+        return
+    ind = ppr.find(_w('ind'))
+    if ind is not None:
+        for side, names in (('left', ('left', 'start')), ('right', ('right', 'end'))):
+            for name in names:
+                if ind.get(_w(name)) is not None:
+                    props[side] = _twips(ind.get(_w(name)))
+                    break
+    spacing = ppr.find(_w('spacing'))
+    if spacing is not None:
+        for name in ('before', 'after', 'line'):
+            if spacing.get(_w(name)) is not None:
+                props[name] = int(spacing.get(_w(name)))
+        if spacing.get(_w('lineRule')) is not None:
+            props['line_rule'] = spacing.get(_w('lineRule'))
+    jc = ppr.find(_w('jc'))
+    if jc is not None:
+        props['align'] = jc.get(_w('val'))
+    tabs = ppr.find(_w('tabs'))
+    if tabs is not None:
+        props['tabs'] = sorted(
+            _twips(tab.get(_w('pos'))) for tab in tabs
+            if tab.get(_w('val')) != 'clear'
+        )
+
+
+class _Styles:
+    """Resolve paragraph and table style properties through basedOn chains"""
+
+    def __init__(self, styles_element):
+        self._styles = {
+            style.get(_w('styleId')): style for style in styles_element.iter(_w('style'))
+        }
+        self.default_size = DEFAULT_FONT_SIZE
+        default_rpr = styles_element.find(f"{_w('docDefaults')}/{_w('rPrDefault')}/{_w('rPr')}")
+        if default_rpr is not None and default_rpr.find(_w('sz')) is not None:
+            self.default_size = int(default_rpr.find(_w('sz')).get(_w('val'))) / 2
+        self.default_paragraph = next(
+            (style_id for style_id, style in self._styles.items()
+             if style.get(_w('type')) == 'paragraph' and style.get(_w('default')) in ('1', 'true')),
+            None
+        )
+
+    def _chain(self, style_id: Optional[str]) -> List:
+        chain = []
+        while style_id in self._styles and len(chain) < 20:
+            style = self._styles[style_id]
+            chain.insert(0, style)
+            based_on = style.find(_w('basedOn'))
+            style_id = based_on.get(_w('val')) if based_on is not None else None
+        return chain
+
+    def paragraph(self, style_id: Optional[str]) -> Tuple[Dict, Dict]:
+        """Paragraph and run properties inherited from a paragraph style"""
+        paragraph_props = {}
+        run_props = {'size': self.default_size, 'bold': False}
+        for style in self._chain(style_id or self.default_paragraph):
+            _read_paragraph_props(style.find(_w('pPr')), paragraph_props)
+            _read_run_props(style.find(_w('rPr')), run_props)
+        return paragraph_props, run_props
+
+    def table(self, style_id: Optional[str]) -> Tuple[Dict, Dict]:
+        """Borders and cell margins inherited from a table style"""
+        borders = {}
+        margins = {'left': DEFAULT_CELL_MARGIN, 'right': DEFAULT_CELL_MARGIN, 'top': 0, 'bottom': 0}
+        for style in self._chain(style_id):
+            _read_table_props(style.find(_w('tblPr')), borders, margins)
+        return borders, margins
+
+
+def _read_table_props(tblpr, borders: Dict, margins: Dict):
+    if tblpr is None:
+        return
+    border_element = tblpr.find(_w('tblBorders'))
+    if border_element is not None:
+        for border in border_element:
+            side = border.tag.split('}')[1]
+            if border.get(_w('val')) in ('none', 'nil'):
+                borders[side] = None
+            else:
+                borders[side] = int(border.get(_w('sz'), '4')) / 8
+    margin_element = tblpr.find(_w('tblCellMar'))
+    if margin_element is not None:
+        for margin in margin_element:
+            side = {'start': 'left', 'end': 'right'}.get(margin.tag.split('}')[1], margin.tag.split('}')[1])
+            margins[side] = _twips(margin.get(_w('w')))
+
+
+class Run:
+    """A span of text set in one font"""
+
+    def __init__(self, text: str, size: float, bold: bool):
+        self.text = text
+        self.size = size
+        self.bold = bold
+
+
+class ParagraphBlock:
+    """A paragraph with its resolved formatting"""
+
+    def __init__(self, runs: List[Run], props: Dict, mark_size: float):
+        self.runs = runs
+        self.left = props.get('left', 0)
+        self.right = props.get('right', 0)
+        self.before = props.get('before', 0) / TWIPS_PER_POINT
+        self.after = props.get('after', 0) / TWIPS_PER_POINT
+        self.line = props.get('line')
+        self.line_rule = props.get('line_rule', 'auto')
+        self.align = props.get('align', 'left')
+        self.tabs = props.get('tabs', [])
+        self.mark_size = mark_size
+        self.section_break = False
+
+    def layout(self, width: float, values: Dict[str, str]) -> Tuple[float, List]:
+        """
+        Wrap the paragraph into a column
+
+        Args:
+            width: Column width in points
+            values: Placeholder replacements
+
+        Returns:
+            Tuple of (height, drawing items relative to the top-left corner)
+        """
+        right_edge = width - self.right
+        lines = [[]]
+        x = self.left
+
+        for run in self.runs:
+            text = PLACEHOLDER_PATTERN.sub(lambda m: values.get(m.group(0), m.group(0)), run.text)
+            for token in TOKEN_PATTERN.findall(text):
+                if token == '\n':
+                    lines.append([])
+                    x = self.left
+                elif token == '\t':
+                    x = next((stop for stop in self.tabs if stop > x),
+                             (int(x // DEFAULT_TAB_STOP) + 1) * DEFAULT_TAB_STOP)
+                elif token.startswith(' '):
+                    if lines[-1]:
+                        x += text_width(token, run.size, run.bold)
+                else:
+                    token_width = text_width(token, run.size, run.bold)
+                    if lines[-1] and x + token_width > right_edge:
+                        lines.append([])
+                        x = self.left
+                    lines[-1].append((x, token, run.size, run.bold, token_width))
+                    x += token_width
+
+        items = []
+        y = self.before
+        for line in lines:
+            size = max((fragment[2] for fragment in line), default=self.mark_size)
+            height = self._line_height(size)
+            shift = 0
+            if line and self.align in ('right', 'end', 'center'):
+                line_end = line[-1][0] + line[-1][4]
+                shift = right_edge - line_end
+                if self.align == 'center':
+                    shift = (shift - (line[0][0] - self.left)) / 2
+            baseline = y + height - size * (LINE_HEIGHT_FACTOR - ASCENT_FACTOR)
+            for fragment_x, token, token_size, bold, _ in line:
+                items.append(('text', fragment_x + shift, baseline, token, token_size, bold))
+            y += height
+        return y + self.after, items
+
+    def _line_height(self, size: float) -> float:
+        natural = size * LINE_HEIGHT_FACTOR
+        if self.line is None:
+            return natural
+        if self.line_rule == 'exact':
+            return self.line / TWIPS_PER_POINT
+        if self.line_rule == 'atLeast':
+            return max(natural, self.line / TWIPS_PER_POINT)
+        return natural * self.line / 240
+
+
+class CellBlock:
+    """A table cell spanning one or more grid columns"""
+
+    def __init__(self, span: int, paragraphs: List[ParagraphBlock],
+                 fill: Optional[Tuple[float, float, float]], valign: str):
+        self.span = span
+        self.paragraphs = paragraphs
+        self.fill = fill
+        self.valign = valign
+
+
+class TableBlock:
+    """A table laid out on its column grid"""
+
+    def __init__(self, grid: List[float], rows: List[Tuple[float, str, List[CellBlock]]],
+                 indent: float, borders: Dict, margins: Dict, floating: Optional[Dict]):
+        self.grid = grid
+        self.rows = rows
+        self.indent = indent
+        self.borders = borders
+        self.margins = margins
+        self.floating = floating
+        self.width = sum(grid)
+
+    def layout(self, values: Dict[str, str]) -> Tuple[float, List]:
+        """Lay out every row; returns (height, drawing items)"""
+        fills, texts, rules = [], [], []
+        edges = [0]
+        for column_width in self.grid:
+            edges.append(edges[-1] + column_width)
+
+        y = 0
+        row_bounds = [0]
+        for min_height, height_rule, cells in self.rows:
+            placed = []
+            column = 0
+            content_height = 0
+            for cell in cells:
+                x0 = edges[column]
+                x1 = edges[min(column + cell.span, len(self.grid))]
+                column += cell.span
+                inner_width = x1 - x0 - self.margins['left'] - self.margins['right']
+                cell_items = []
+                cell_y = 0
+                for paragraph in cell.paragraphs:
+                    height, items = paragraph.layout(inner_width, values)
+                    cell_items.extend(_offset(items, 0, cell_y))
+                    cell_y += height
+                placed.append((cell, x0, x1, cell_y, cell_items))
+                content_height = max(content_height, cell_y)
+
+            row_height = content_height + self.margins['top'] + self.margins['bottom']
+            if height_rule == 'exact':
+                row_height = min_height
+            else:
+                row_height = max(row_height, min_height)
+
+            for cell, x0, x1, cell_height, cell_items in placed:
+                if cell.fill:
+                    fills.append(('rect', x0, y, x1 - x0, row_height, cell.fill))
+                free = row_height - self.margins['top'] - self.margins['bottom'] - cell_height
+                dy = self.margins['top'] + {'center': free / 2, 'bottom': free}.get(cell.valign, 0)
+                texts.extend(_offset(cell_items, x0 + self.margins['left'], y + dy))
+                if x0 > 0 and self.borders.get('insideV'):
+                    rules.append(('line', x0, y, x0, y + row_height, self.borders['insideV']))
+
+            y += row_height
+            row_bounds.append(y)
+
+        for index, bound in enumerate(row_bounds):
+            side = 'top' if index == 0 else 'bottom' if index == len(row_bounds) - 1 else 'insideH'
+            if self.borders.get(side):
+                rules.append(('line', 0, bound, self.width, bound, self.borders[side]))
+        for side, x in (('left', 0), ('right', self.width)):
+            if self.borders.get(side):
+                rules.append(('line', x, 0, x, y, self.borders[side]))
+
+        return y, fills + texts + rules
+
+
+class Section:
+    """A run of blocks sharing one column setup"""
+
+    def __init__(self, columns: List[Tuple[float, float]], blocks: List):
+        self.columns = columns
+        self.blocks = blocks
+
+
+def _offset(items: List, dx: float, dy: float) -> List:
+    """Translate drawing items"""
+    moved = []
+    for item in items:
+        if item[0] == 'line':
+            moved.append(('line', item[1] + dx, item[2] + dy, item[3] + dx, item[4] + dy, item[5]))
+        else:
+            moved.append((item[0], item[1] + dx, item[2] + dy) + item[3:])
+    return moved
+
+
+def _parse_color(value: Optional[str]) -> Optional[Tuple[float, float, float]]:
+    if not value or value == 'auto' or len(value) != 6:
+        return None
+    return tuple(int(value[i:i + 2], 16) / 255 for i in (0, 2, 4))
+
+
+class StubLayout:
+    """Page geometry and content blocks compiled from a DOCX template"""
+
+    _cache: Dict[Tuple[str, float], 'StubLayout'] = {}
+    _cache_lock = threading.Lock()
+
+    def __init__(self, page_size: Tuple[float, float], margins: Dict, sections: List[Section]):
+        self.page_width, self.page_height = page_size
+        self.margins = margins
+        self.sections = sections
+
+    @classmethod
+    def load(cls, path: str, prepare: Optional[Callable] = None) -> 'StubLayout':
+        """
+        Compile a template once per file version
+
+        Args:
+            path: DOCX template path
+            prepare: Optional callback applied to the loaded Document
+                before compiling, e.g. to apply the stub cell formatting
+
+        Returns:
+            The compiled layout
+        """
+        key = (os.path.abspath(path), os.path.getmtime(path))
+        with cls._cache_lock:
+            layout = cls._cache.get(key)
+        if layout is None:
+            doc = template_cache.clone(path)
+            if prepare:
+                prepare(doc)
+            layout = cls.from_document(doc)
+            with cls._cache_lock:
+                cls._cache = {k: v for k, v in cls._cache.items() if k[0] != key[0]}
+                cls._cache[key] = layout
+        return layout
+
+    @classmethod
+    def from_document(cls, doc) -> 'StubLayout':
+        """Compile the body of a python-docx Document"""
+        styles = _Styles(doc.styles.element)
+        body = doc.element.body
+
+        sections = []
+        blocks = []
+        for child in body.iterchildren():
+            if child.tag == _w('p'):
+                blocks.append(cls._compile_paragraph(child, styles))
+                sect_pr = child.find(f"{_w('pPr')}/{_w('sectPr')}")
+                if sect_pr is not None:
+                    blocks[-1].section_break = not blocks[-1].runs
+                    sections.append(Section(cls._compile_columns(sect_pr, body), blocks))
+                    blocks = []
+            elif child.tag == _w('tbl'):
+                blocks.append(cls._compile_table(child, styles))
+
+        final_sect_pr = body.find(_w('sectPr'))
+        sections.append(Section(cls._compile_columns(final_sect_pr, body), blocks))
+
+        page_size = final_sect_pr.find(_w('pgSz'))
+        page_margins = final_sect_pr.find(_w('pgMar'))
+        margins = {
+            side: _twips(page_margins.get(_w(side)))
+            for side in ('top', 'right', 'bottom', 'left')
+        }
+        return cls((_twips(page_size.get(_w('w'))), _twips(page_size.get(_w('h')))),
+                   margins, sections)
+
+    @staticmethod
+    def _compile_paragraph(element, styles: _Styles) -> ParagraphBlock:
+        ppr = element.find(_w('pPr'))
+        style = ppr.find(_w('pStyle')) if ppr is not None else None
+        props, run_defaults = styles.paragraph(style.get(_w('val')) if style is not None else None)
+        _read_paragraph_props(ppr, props)
+
+        mark_props = dict(run_defaults)
+        if ppr is not None:
+            _read_run_props(ppr.find(_w('rPr')), mark_props)
+
+        runs = []
+        for run in element.iter(_w('r')):
+            run_props = dict(run_defaults)
+            _read_run_props(run.find(_w('rPr')), run_props)
+            text = ''.join(
+                (child.text or '') if child.tag == _w('t')
+                else '\t' if child.tag == _w('tab')
+                else '\n' if child.tag in (_w('br'), _w('cr'))
+                else ''
+                for child in run
+            )
+            if not text:
+                continue
+            # Join runs with the same font so placeholders split by Word stay whole
+            if runs and (runs[-1].size, runs[-1].bold) == (run_props['size'], run_props['bold']):
+                runs[-1].text += text
+            else:
+                runs.append(Run(text, run_props['size'], run_props['bold']))
+
+        return ParagraphBlock(runs, props, mark_props['size'])
+
+    @classmethod
+    def _compile_table(cls, element, styles: _Styles) -> TableBlock:
+        tblpr = element.find(_w('tblPr'))
+        style = tblpr.find(_w('tblStyle'))
+        borders, margins = styles.table(style.get(_w('val')) if style is not None else None)
+        _read_table_props(tblpr, borders, margins)
+
+        grid = [_twips(column.get(_w('w'))) for column in element.find(_w('tblGrid'))]
+        indent = tblpr.find(_w('tblInd'))
+        floating = tblpr.find(_w('tblpPr'))
+        if floating is not None:
+            floating = {name: floating.get(_w(name)) for name in (
+                'horzAnchor', 'vertAnchor', 'tblpXSpec', 'tblpX', 'tblpY'
+            )}
+
+        rows = []
+        for row in element.findall(_w('tr')):
+            row_height = row.find(f"{_w('trPr')}/{_w('trHeight')}")
+            min_height = _twips(row_height.get(_w('val'))) if row_height is not None else 0
+            height_rule = row_height.get(_w('hRule'), 'atLeast') if row_height is not None else 'atLeast'
+            cells = []
+            for cell in row.findall(_w('tc')):
+                tcpr = cell.find(_w('tcPr'))
+                span = tcpr.find(_w('gridSpan')) if tcpr is not None else None
+                shading = tcpr.find(_w('shd')) if tcpr is not None else None
+                valign = tcpr.find(_w('vAlign')) if tcpr is not None else None
+                cells.append(CellBlock(
+                    int(span.get(_w('val'))) if span is not None else 1,
+                    [cls._compile_paragraph(p, styles) for p in cell.findall(_w('p'))],
+                    _parse_color(shading.get(_w('fill'))) if shading is not None else None,
+                    valign.get(_w('val')) if valign is not None else 'top',
+                ))
+            rows.append((min_height, height_rule, cells))
+
+        return TableBlock(grid, rows, _twips(indent.get(_w('w'))) if indent is not None else 0,
+                          borders, margins, floating)
+
+    @staticmethod
+    def _compile_columns(sect_pr, body) -> List[Tuple[float, float]]:
+        """Column widths and gaps of a section, in points"""
+        page_size = body.find(f"{_w('sectPr')}/{_w('pgSz')}")
+        page_margins = body.find(f"{_w('sectPr')}/{_w('pgMar')}")
+        text_width_pt = (_twips(page_size.get(_w('w'))) - _twips(page_margins.get(_w('left')))
+                         - _twips(page_margins.get(_w('right'))))
+
+        cols = sect_pr.find(_w('cols'))
+        if cols is None:
+            return [(text_width_pt, 0)]
+        explicit = cols.findall(_w('col'))
+        if explicit:
+            return [(_twips(col.get(_w('w'))), _twips(col.get(_w('space')))) for col in explicit]
+
+        count = int(cols.get(_w('num'), '1'))
+        space = _twips(cols.get(_w('space'), '720'))
+        width = (text_width_pt - space * (count - 1)) / count
+        return [(width, space)] * count
+
+    def render(self, values: Dict[str, str], pdf: Optional[PdfDocument] = None) -> PdfDocument:
+        """
+        Draw one stub
+
+        Args:
+            values: Placeholder replacements, as produced by _get_replacements
+            pdf: Document to append the stub's pages to; a new one by default
+
+        Returns:
+            The PDF document
+        """
+        pdf = pdf or PdfDocument()
+        page = pdf.add_page(self.page_width, self.page_height)
+        bottom = self.page_height - self.margins['bottom']
+        y = self.margins['top']
+
+        for section in self.sections:
+            lefts = []
+            x = self.margins['left']
+            for width, space in section.columns:
+                lefts.append(x)
+                x += width + space
+
+            if len(section.columns) == 1:
+                page, y = self._flow_single(pdf, page, section, lefts[0], y, bottom, values)
+            else:
+                y = self._flow_columns(page, section, lefts, y, values)
+
+        return pdf
+
+    def _flow_single(self, pdf: PdfDocument, page: PdfPage, section: Section,
+                     left: float, y: float, bottom: float,
+                     values: Dict[str, str]) -> Tuple[PdfPage, float]:
+        width = section.columns[0][0]
+        pending = []
+        for block in section.blocks:
+            if isinstance(block, TableBlock) and block.floating:
+                pending.append(block)
+                continue
+            if isinstance(block, TableBlock):
+                height, items = block.layout(values)
+                x = left + block.indent
+            else:
+                height, items = block.layout(width, values)
+                x = left
+            if y + height > bottom and y > self.margins['top']:
+                page = pdf.add_page(self.page_width, self.page_height)
+                y = self.margins['top']
+            for table in pending:
+                self._draw_floating(page, table, y, values)
+            pending = []
+            _draw(page, _offset(items, x, y))
+            y += height
+        for table in pending:
+            self._draw_floating(page, table, y, values)
+        return page, y
+
+    def _flow_columns(self, page: PdfPage, section: Section, lefts: List[float],
+                      y: float, values: Dict[str, str]) -> float:
+        """Balance the blocks of a continuous multi-column section"""
+        # Empty paragraphs that only carry the section break take no room
+        flow = [block for block in section.blocks
+                if not (isinstance(block, TableBlock) and block.floating)
+                and not getattr(block, 'section_break', False)]
+        layouts = [
+            [block.layout(values) if isinstance(block, TableBlock) else block.layout(width, values)
+             for width, _ in section.columns]
+            for block in flow
+        ]
+
+        def assign(capacity: float) -> List[List[int]]:
+            columns = [[] for _ in section.columns]
+            column, used = 0, 0
+            for index, options in enumerate(layouts):
+                height = options[column][0]
+                if used and used + height > capacity and column < len(columns) - 1:
+                    column, used = column + 1, 0
+                    height = options[column][0]
+                columns[column].append(index)
+                used += height
+            return columns
+
+        def height_of(columns: List[List[int]]) -> float:
+            return max(sum(layouts[i][c][0] for i in column) for c, column in enumerate(columns))
+
+        # Balance like Word: find the shortest section, and among the column
+        # splits that achieve it prefer the one that fills earlier columns
+        total = sum(max(height for height, _ in options) for options in layouts)
+        capacity = sum(min(height for height, _ in options) for options in layouts) / len(section.columns)
+        columns = assign(capacity)
+        best = height_of(columns)
+        while capacity < total:
+            capacity += 1
+            candidate = assign(capacity)
+            height = height_of(candidate)
+            if height <= best + 0.01:
+                columns, best = candidate, min(best, height)
+
+        section_height = 0
+        anchors = {}
+        for column_index, column in enumerate(columns):
+            column_y = y
+            for index in column:
+                height, items = layouts[index][column_index]
+                block = flow[index]
+                x = lefts[column_index] + (block.indent if isinstance(block, TableBlock) else 0)
+                anchors[id(block)] = column_y
+                _draw(page, _offset(items, x, column_y))
+                column_y += height
+            section_height = max(section_height, column_y - y)
+
+        # A floating table is anchored to the paragraph that follows it
+        anchor_y = y + section_height
+        for block in reversed(section.blocks):
+            if isinstance(block, TableBlock) and block.floating:
+                self._draw_floating(page, block, anchor_y, values)
+            else:
+                anchor_y = anchors.get(id(block), anchor_y)
+        return y + section_height
+
+    def _draw_floating(self, page: PdfPage, table: TableBlock, anchor_y: float,
+                       values: Dict[str, str]):
+        """Draw a table positioned relative to the margin and its anchor paragraph"""
+        spec = table.floating
+        left = 0 if spec['horzAnchor'] == 'page' else self.margins['left']
+        right = self.page_width - (0 if spec['horzAnchor'] == 'page' else self.margins['right'])
+        if spec['tblpXSpec'] == 'right':
+            x = right - table.width
+        elif spec['tblpXSpec'] == 'center':
+            x = (left + right - table.width) / 2
+        else:
+            x = left + _twips(spec['tblpX'])
+
+        offset = _twips(spec['tblpY'])
+        if spec['vertAnchor'] == 'page':
+            y = offset
+        elif spec['vertAnchor'] == 'margin':
+            y = self.margins['top'] + offset
+        else:
+            y = anchor_y + offset
+
+        _, items = table.layout(values)
+        _draw(page, _offset(items, x, y))
+
+
+def _draw(page: PdfPage, items: List):
+    for item in items:
+        if item[0] == 'text':
+            page.text(item[1], item[2], item[3], item[4], item[5])
+        elif item[0] == 'rect':
+            page.fill_rect(item[1], item[2], item[3], item[4], item[5])
+        else:
+            page.line(item[1], item[2], item[3], item[4], item[5])
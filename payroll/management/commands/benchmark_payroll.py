@@ -0,0 +1,247 @@
+"""
+Time the stages of stub generation across request sizes
+"""
+
+# Standard library imports
+import json
+import os
+import platform
+import resource
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+# Third-party imports
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+# Local application imports
+from payroll.converters import get_converter
+from payroll.views import PayrollCalculator, PayrollDocumentGenerator
+
+STAGES = ['calculate', 'schedule', 'fill', 'docx', 'convert', 'zip', 'end_to_end']
+
+# Weekly stubs from the first pay date of 2024, so n periods span n weeks
+BENCH_START = datetime(2024, 1, 5)
+BENCH_INPUTS = {
+    'name': 'Bench', 'last_name': 'Mark', 'client_address': '1 Main St',
+    'city_state': 'Miami, FL', 'company': 'ACME', 'address_co': '2 Side St',
+    'check_id': '1001', 'ssn_digits': '1234', 'dependents': '0',
+    'anual': '85000', 'period': '52',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Time each stage of stub generation (calculation, schedule, template "
+        "fill, DOCX render, PDF conversion, ZIP assembly) and the whole "
+        "pipeline for several request sizes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--periods', default='1,26,52,260',
+                            help="Comma-separated numbers of stubs per request")
+        parser.add_argument('--repeat', type=int, default=5,
+                            help="Timed runs per request size")
+        parser.add_argument('--output', default=None,
+                            help="Write the results as JSON to this file")
+        parser.add_argument('--baseline', default=None,
+                            help="Compare against results saved earlier with --output")
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help="Fraction a stage's p50 may exceed the baseline by")
+        parser.add_argument('--min-delta', type=float, default=5.0,
+                            help="Milliseconds a stage's p50 must also grow by to count as slower")
+        parser.add_argument('--fake-converter', action='store_true',
+                            help="Write placeholder PDFs instead of running LibreOffice")
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['periods'].split(',')]
+        if options['repeat'] < 1:
+            raise CommandError("--repeat must be at least 1")
+
+        overrides = {
+            # Every run renders from scratch and returns the whole archive
+            'PAYROLL_STUB_CACHE': False,
+            'PAYROLL_STREAM_ZIP': False,
+            'PAYROLL_MAX_PERIODS': max(settings.PAYROLL_MAX_PERIODS, *sizes),
+        }
+        if options['fake_converter']:
+            overrides['PAYROLL_CONVERTER'] = 'fake'
+
+        with override_settings(**overrides):
+            results = {
+                'meta': self._meta(options),
+                'sizes': {str(size): self._measure(size, options['repeat']) for size in sizes},
+            }
+
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                json.dump(results, output_file, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if options['baseline']:
+            self._compare(results, options['baseline'], options['tolerance'],
+                          options['min_delta'] / 1000)
+
+    def _measure(self, size: int, repeat: int) -> Dict:
+        """Run one request size repeat times and summarize every stage"""
+        samples = defaultdict(list)
+        data = dict(
+            BENCH_INPUTS,
+            start_period=BENCH_START.strftime('%Y-%m-%d'),
+            end_period=(BENCH_START + timedelta(weeks=size)).strftime('%Y-%m-%d'),
+        )
+
+        for _ in range(repeat):
+            totals = defaultdict(float)
+            self._run_stages(data, totals)
+            for stage in STAGES:
+                samples[stage].append(totals[stage])
+
+        summary = {
+            'stages': {
+                stage: {
+                    'p50': self._percentile(samples[stage], 50),
+                    'p95': self._percentile(samples[stage], 95),
+                }
+                for stage in STAGES
+            },
+            # Peaks over the life of the process, so they only grow with size
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'peak_children_rss_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        }
+        self._report(size, summary)
+        return summary
+
+    def _run_stages(self, data: Dict, totals: Dict[str, float]):
+        """
+        Generate one request stage by stage, adding each stage's time to totals
+
+        The stages call the methods the view runs: fill is the compiled
+        template fill on its own, docx is fill plus save as each stub is
+        rendered, and convert is the configured converter, batched when
+        PAYROLL_BATCH_CONVERSION is on. end_to_end is the whole pipeline.
+        """
+        with self._stage(totals, 'calculate'):
+            payroll_data = PayrollCalculator.calculate(int(data['anual']), int(data['period']))
+        generator = PayrollDocumentGenerator(data, payroll_data)
+        with self._stage(totals, 'schedule'):
+            periods = generator.get_periods()
+
+        with tempfile.TemporaryDirectory(prefix='payroll-bench-',
+                                         dir=settings.PAYROLL_SCRATCH_DIR) as scratch_dir:
+            generator.scratch_dir = scratch_dir
+
+            jobs = []
+            for index, start_period, payment_number in periods:
+                replacements = generator._get_replacements(start_period, payment_number)
+                with self._stage(totals, 'fill'):
+                    generator._get_compiled_template(replacements).fill(replacements)
+                with self._stage(totals, 'docx'):
+                    docx_path = generator._generate_single_docx(index, start_period, payment_number)
+                jobs.append((docx_path, generator._get_pdf_path(start_period)))
+
+            converter = get_converter()
+            with self._stage(totals, 'convert'):
+                if settings.PAYROLL_BATCH_CONVERSION:
+                    converter.convert_many(jobs)
+                else:
+                    for docx_path, pdf_path in jobs:
+                        converter.convert(docx_path, pdf_path)
+
+            pdfs = []
+            for (_, start_period, _), (_, pdf_path) in zip(periods, jobs):
+                with open(pdf_path, 'rb') as pdf_file:
+                    pdfs.append((generator._get_pdf_name(start_period), pdf_file.read()))
+            with self._stage(totals, 'zip'):
+                generator._create_zip_response(pdfs)
+
+        with self._stage(totals, 'end_to_end'):
+            PayrollDocumentGenerator(data, payroll_data).generate_multiple_pdfs()
+
+    def _compare(self, results: Dict, baseline_path: str, tolerance: float, min_delta: float):
+        """
+        Report stages slower than the baseline; fail when any regressed
+
+        A stage regressed when its p50 grew by more than the tolerance and
+        by more than min_delta seconds, so jitter in sub-millisecond stages
+        does not fail the comparison.
+        """
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)
+
+        regressions = []
+        for size, summary in results['sizes'].items():
+            if size not in baseline.get('sizes', {}):
+                continue
+            for stage, timings in summary['stages'].items():
+                before = baseline['sizes'][size]['stages'].get(stage, {}).get('p50')
+                if not before:
+                    continue
+                change = timings['p50'] / before - 1
+                self.stdout.write(
+                    f"{size:>5} periods  {stage:<10}  p50 {self._ms(before)} -> "
+                    f"{self._ms(timings['p50'])}  ({change:+.1%})"
+                )
+                if change > tolerance and timings['p50'] - before > min_delta:
+                    regressions.append(f"{stage} at {size} periods ({change:+.1%})")
+
+        if regressions:
+            raise CommandError(f"Slower than the baseline: {', '.join(regressions)}")
+        self.stdout.write(self.style.SUCCESS("No stage regressed beyond the tolerance"))
+
+    def _report(self, size: int, summary: Dict):
+        """Print one request size's timings"""
+        self.stdout.write(f"{size} period(s)")
+        for stage, timings in summary['stages'].items():
+            self.stdout.write(
+                f"  {stage:<10}  p50 {self._ms(timings['p50'])}  p95 {self._ms(timings['p95'])}"
+            )
+        self.stdout.write(
+            f"  peak RSS {summary['peak_rss_kb'] / 1024:.1f}MB, "
+            f"children {summary['peak_children_rss_kb'] / 1024:.1f}MB"
+        )
+
+    @staticmethod
+    def _meta(options: Dict) -> Dict:
+        """What the results were measured with"""
+        return {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'converter': settings.PAYROLL_CONVERTER,
+            'render_backend': settings.PAYROLL_RENDER_BACKEND,
+            'batch_conversion': settings.PAYROLL_BATCH_CONVERSION,
+            'parallel_workers': settings.PAYROLL_PARALLEL_WORKERS,
+            'repeat': options['repeat'],
+        }
+
+    @staticmethod
+    @contextmanager
+    def _stage(totals: Dict[str, float], stage: str):
+        """Add the time spent in the block to a stage's total"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            totals[stage] += time.perf_counter() - start
+
+    @staticmethod
+    def _percentile(samples: List[float], percentile: int) -> float:
+        """A percentile of durations in seconds"""
+        if len(samples) == 1:
+            return samples[0]
+        return statistics.quantiles(samples, n=100)[percentile - 1]
+
+    @staticmethod
+    def _ms(seconds: float) -> str:
+        """Format a duration in milliseconds"""
+        return f'{seconds * 1000:.3f}ms'
@@ -0,0 +1,132 @@
+"""
+Measure PaymentToken lookup latency as the table grows
+"""
+
+# Standard library imports
+import statistics
+import time
+import uuid
+from datetime import timedelta
+
+# Third-party imports
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+# Local application imports
+from payroll.models import PaymentToken
+
+BENCH_PREFIX = 'bench_'
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the tokens table with synthetic rows and time the lookups of "
+        "payment_success and payroll_view at each size"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000,
+                            help="Synthetic rows to insert in total")
+        parser.add_argument('--steps', type=int, default=4,
+                            help="Number of table sizes to measure at")
+        parser.add_argument('--queries', type=int, default=200,
+                            help="Lookups timed per size")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--explain', action='store_true',
+                            help="Print the query plans at the largest size")
+        parser.add_argument('--keep', action='store_true',
+                            help="Keep the synthetic rows afterwards")
+
+    def handle(self, *args, **options):
+        inserted = 0
+        step_rows = options['rows'] // options['steps']
+        now = timezone.now()
+
+        try:
+            for step in range(1, options['steps'] + 1):
+                target = step_rows * step
+                while inserted < target:
+                    count = min(options['batch_size'], target - inserted)
+                    PaymentToken.objects.bulk_create(
+                        self._synthetic_token(inserted + i, now) for i in range(count)
+                    )
+                    inserted += count
+
+                self._measure(inserted, options['queries'])
+
+            if options['explain']:
+                email, token = self._sample_keys(inserted)
+                self.stdout.write(self._email_lookup(email).explain())
+                self.stdout.write(self._token_lookup(token).explain())
+        finally:
+            if not options['keep']:
+                self._delete_synthetic(options['batch_size'])
+
+    def _measure(self, rows: int, queries: int):
+        """Time both lookups for random existing keys"""
+        email_times, token_times = [], []
+        for i in range(queries):
+            email, token = self._sample_keys((i * 7919) % rows)
+
+            start = time.perf_counter()
+            self._email_lookup(email).first()
+            email_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            self._token_lookup(token).first()
+            token_times.append(time.perf_counter() - start)
+
+        self.stdout.write(
+            f"{rows:>10} rows  "
+            f"payment_success p50 {self._ms(email_times, 50)} p95 {self._ms(email_times, 95)}  "
+            f"payroll_view p50 {self._ms(token_times, 50)} p95 {self._ms(token_times, 95)}"
+        )
+
+    @staticmethod
+    def _email_lookup(email: str):
+        """The query payment_success runs"""
+        return PaymentToken.usable().filter(
+            customer_email=email
+        ).order_by('-created_at').values_list('token', flat=True)
+
+    @staticmethod
+    def _token_lookup(token: uuid.UUID):
+        """The query payroll_view runs"""
+        return PaymentToken.objects.only(
+            'id', 'token', 'is_paid', 'is_used', 'expires_at'
+        ).filter(token=token)
+
+    @staticmethod
+    def _synthetic_token(number: int, now) -> PaymentToken:
+        """A token whose keys can be derived again from its number"""
+        return PaymentToken(
+            token=uuid.UUID(int=number + 1),
+            stripe_session_id=f'{BENCH_PREFIX}{number}',
+            customer_email=f'{BENCH_PREFIX}{number % 50_000}@example.com',
+            is_paid=number % 3 != 0,
+            is_used=number % 5 == 0,
+            expires_at=now + timedelta(hours=24 - number % 48),
+        )
+
+    @staticmethod
+    def _sample_keys(number: int):
+        """Email and token of the synthetic row with this number"""
+        return f'{BENCH_PREFIX}{number % 50_000}@example.com', uuid.UUID(int=number + 1)
+
+    @staticmethod
+    def _delete_synthetic(batch_size: int):
+        """Remove the synthetic rows in primary key batches"""
+        while True:
+            ids = list(
+                PaymentToken.objects.filter(stripe_session_id__startswith=BENCH_PREFIX)
+                .order_by().values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                return
+            PaymentToken.objects.filter(id__in=ids).delete()
+
+    @staticmethod
+    def _ms(samples, percentile: int) -> str:
+        """Format a percentile of durations in milliseconds"""
+        value = statistics.quantiles(samples, n=100)[percentile - 1] if len(samples) > 1 else samples[0]
+        return f'{value * 1000:.3f}ms'
@@ -0,0 +1,88 @@
+"""
+Delete payment tokens that expired before the retention window
+"""
+
+# Standard library imports
+import os
+import time
+from datetime import timedelta
+
+# Third-party imports
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+# Local application imports
+from payroll.models import GenerationJob, PaymentToken
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete tokens whose expires_at is older than the retention window, "
+        "in small batches so no long lock is held"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int,
+                            default=settings.PAYROLL_TOKEN_RETENTION_DAYS,
+                            help="Keep tokens this many days past their expiry")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Rows deleted per transaction")
+        parser.add_argument('--sleep', type=float, default=0.1,
+                            help="Seconds to pause between batches")
+        parser.add_argument('--max-batches', type=int, default=None,
+                            help="Stop after this many batches")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report what would be deleted")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['retention_days'])
+        expired = PaymentToken.objects.filter(expires_at__lt=cutoff)
+
+        if options['dry_run']:
+            stats = expired.aggregate(
+                total=Count('id'),
+                unpaid=Count('id', filter=Q(is_paid=False)),
+                paid_unused=Count('id', filter=Q(is_paid=True, is_used=False)),
+                used=Count('id', filter=Q(is_used=True)),
+            )
+            self.stdout.write(
+                f"Would delete {stats['total']} token(s) expired before {cutoff:%Y-%m-%d %H:%M}: "
+                f"{stats['unpaid']} unpaid, {stats['paid_unused']} paid and unused, "
+                f"{stats['used']} used"
+            )
+            return
+
+        deleted = 0
+        batches = 0
+        while options['max_batches'] is None or batches < options['max_batches']:
+            # Walk the expires_at index and delete by primary key, so each
+            # transaction locks only the rows of one batch
+            ids = list(
+                expired.order_by('expires_at').values_list('id', flat=True)[:options['batch_size']]
+            )
+            if not ids:
+                break
+
+            with transaction.atomic():
+                result_paths = list(
+                    GenerationJob.objects.filter(token_id__in=ids)
+                    .exclude(result_path='').values_list('result_path', flat=True)
+                )
+                expired.filter(id__in=ids).delete()
+
+            # Finished archives go with their jobs
+            for result_path in result_paths:
+                try:
+                    os.remove(result_path)
+                except FileNotFoundError:
+                    pass
+
+            deleted += len(ids)
+            batches += 1
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        self.stdout.write(f"Deleted {deleted} token(s) expired before {cutoff:%Y-%m-%d %H:%M}")
@@ -0,0 +1,45 @@
+"""
+Run queued stub generation jobs
+"""
+
+# Standard library imports
+import time
+
+# Third-party imports
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Local application imports
+from payroll.jobs import claim_next_job, requeue_stale_jobs, run_job
+from payroll.webhooks import process_pending_events
+
+
+class Command(BaseCommand):
+    help = "Run queued payroll generation jobs and pending Stripe events until interrupted"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Exit once the queue is empty instead of polling"
+        )
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale_jobs()
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale job(s)")
+
+        while True:
+            applied = process_pending_events()
+            if applied:
+                self.stdout.write(f"Applied {applied} pending Stripe event(s)")
+
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(settings.PAYROLL_JOB_POLL_INTERVAL)
+                continue
+
+            self.stdout.write(f"Running job {job.id}")
+            run_job(job)
+            self.stdout.write(f"Job {job.id} {job.status}")
@@ -0,0 +1,330 @@
+"""
+Timing spans, counters and their Prometheus text exposition
+"""
+
+# Standard library imports
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import nullcontext
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Third-party imports
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+logger = logging.getLogger('payroll.timing')
+
+# Upper bounds in seconds; conversions take seconds, cache hits microseconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+METRICS = {
+    'payroll_span_seconds': ('histogram', "Time spent in each instrumented stage"),
+    'payroll_request_seconds': ('histogram', "Time until a view returned its response"),
+    'payroll_stub_cache_total': ('counter', "Stub cache lookups by result"),
+    'payroll_admission_rejected_total': ('counter', "Generations turned away for lack of a slot"),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+_NOOP = nullcontext()
+
+# (stage, seconds) pairs of the request being handled, when it is logged
+_request_spans = contextvars.ContextVar('payroll_request_spans', default=None)
+
+
+class Registry:
+    """
+    Histograms and counters of one process
+
+    With PAYROLL_METRICS_DIR set, every process writes a snapshot of its
+    values to its own file there, and collect() adds up the files of all
+    processes, so any worker can answer a scrape for the whole server.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        # (name, labels) -> per-bucket counts, then sum, then count
+        self._histograms: Dict[Tuple[str, Labels], List[float]] = {}
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._flushed_at = 0.0
+
+    def observe(self, name: str, labels: Labels, value: float):
+        """Add one observation to a histogram"""
+        with self._lock:
+            self._check_fork()
+            series = self._histograms.get((name, labels))
+            if series is None:
+                series = self._histograms[(name, labels)] = [0] * (len(BUCKETS) + 3)
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(BUCKETS)] += 1
+            series[-2] += value
+            series[-1] += 1
+        self._maybe_flush()
+
+    def inc(self, name: str, labels: Labels, amount: float = 1):
+        """Add to a counter"""
+        with self._lock:
+            self._check_fork()
+            self._counters[(name, labels)] = self._counters.get((name, labels), 0) + amount
+        self._maybe_flush()
+
+    def snapshot(self) -> Dict:
+        """The values of this process, in a JSON-friendly form"""
+        with self._lock:
+            self._check_fork()
+            return {
+                'histograms': [[name, list(labels), list(series)]
+                               for (name, labels), series in self._histograms.items()],
+                'counters': [[name, list(labels), value]
+                             for (name, labels), value in self._counters.items()],
+            }
+
+    def flush(self):
+        """Write this process's snapshot to its file, if a directory is set"""
+        directory = settings.PAYROLL_METRICS_DIR
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'metrics-{os.getpid()}.json')
+
+        # Replace the file whole so a scrape never reads half of it
+        fd, temp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as temp_file:
+            json.dump(self.snapshot(), temp_file)
+        os.replace(temp_path, path)
+
+    def collect(self) -> List[Dict]:
+        """Snapshots of this process and of every other process that wrote one"""
+        snapshots = [self.snapshot()]
+        directory = settings.PAYROLL_METRICS_DIR
+        if not directory or not os.path.isdir(directory):
+            return snapshots
+
+        own_file = f'metrics-{os.getpid()}.json'
+        for name in os.listdir(directory):
+            if not name.startswith('metrics-') or name == own_file:
+                continue
+            try:
+                with open(os.path.join(directory, name)) as snapshot_file:
+                    snapshots.append(json.load(snapshot_file))
+            except (FileNotFoundError, ValueError):
+                continue
+        return snapshots
+
+    def _maybe_flush(self):
+        """Flush at most once per PAYROLL_METRICS_FLUSH_INTERVAL"""
+        now = time.monotonic()
+        if settings.PAYROLL_METRICS_DIR and now - self._flushed_at >= settings.PAYROLL_METRICS_FLUSH_INTERVAL:
+            self._flushed_at = now
+            self.flush()
+
+    def _check_fork(self):
+        """A forked child starts empty instead of reporting its parent's values"""
+        if self._pid != os.getpid():
+            self._reset()
+
+
+registry = Registry()
+
+
+@atexit.register
+def _flush_at_exit():
+    """Leave the final values of an exiting process for the others to report"""
+    if settings.PAYROLL_METRICS:
+        registry.flush()
+
+
+class _Span:
+    """Time a block into payroll_span_seconds and the request's timing log"""
+
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        if settings.PAYROLL_METRICS:
+            registry.observe('payroll_span_seconds', (('stage', self.stage),), elapsed)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((self.stage, elapsed))
+        return False
+
+
+def span(stage: str):
+    """
+    Context manager timing a stage
+
+    Returns a shared no-op when metrics are off and the request is not
+    being logged, so instrumented code pays one settings lookup.
+    """
+    if not settings.PAYROLL_METRICS and _request_spans.get() is None:
+        return _NOOP
+    return _Span(stage)
+
+
+def timed(stage: str) -> Callable:
+    """Decorator timing every call of a function as a stage"""
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def increment(name: str, amount: float = 1, **labels: str):
+    """Add to a counter when metrics are on"""
+    if settings.PAYROLL_METRICS:
+        registry.inc(name, tuple(sorted(labels.items())), amount)
+
+
+def render_prometheus() -> str:
+    """Every process's metrics in the Prometheus text format"""
+    histograms: Dict[Tuple[str, Labels], List[float]] = {}
+    counters: Dict[Tuple[str, Labels], float] = {}
+    for snapshot in registry.collect():
+        for name, labels, series in snapshot['histograms']:
+            key = (name, tuple(tuple(label) for label in labels))
+            total = histograms.setdefault(key, [0] * len(series))
+            for i, value in enumerate(series):
+                total[i] += value
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(tuple(label) for label in labels))
+            counters[key] = counters.get(key, 0) + value
+
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'counter':
+            for (series_name, labels), value in sorted(counters.items()):
+                if series_name == name:
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+            continue
+
+        for (series_name, labels), series in sorted(histograms.items()):
+            if series_name != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), series):
+                cumulative += count
+                le = bound if bound == '+Inf' else _format_value(bound)
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", le),))} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(series[-2])}')
+            lines.append(f'{name}_count{_format_labels(labels)} {series[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels: Labels) -> str:
+    """Render labels as {key="value",...}, escaped as the format requires"""
+    if not labels:
+        return ''
+    pairs = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{key}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value: float) -> str:
+    """Render whole numbers without a trailing .0"""
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class TimingMiddleware:
+    """
+    Time every request; optionally log its stages as one JSON line
+
+    Removed from the stack at startup when PAYROLL_METRICS and
+    PAYROLL_TIMING_LOG are both off. Streamed responses are timed up to
+    the point the view returned, before the body is sent.
+    """
+
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response: Callable):
+        if not settings.PAYROLL_METRICS and not settings.PAYROLL_TIMING_LOG:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self._acall(request)
+
+        spans, token, start = self._start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_spans.reset(token)
+        self._finish(request, response, spans, start)
+        return response
+
+    async def _acall(self, request):
+        spans, token, start = self._start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_spans.reset(token)
+        self._finish(request, response, spans, start)
+        return response
+
+    @staticmethod
+    def _start():
+        spans = [] if settings.PAYROLL_TIMING_LOG else None
+        return spans, _request_spans.set(spans), time.perf_counter()
+
+    @staticmethod
+    def _finish(request, response, spans: Optional[List[Tuple[str, float]]], start: float):
+        elapsed = time.perf_counter() - start
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name if match and match.url_name else 'unmatched'
+
+        if settings.PAYROLL_METRICS:
+            registry.observe('payroll_request_seconds', (('view', view),), elapsed)
+
+        if spans is not None:
+            # Stages that ran many times, such as per-stub fills, are summed
+            stages: Dict[str, Dict[str, float]] = {}
+            for stage, seconds in spans:
+                entry = stages.setdefault(stage, {'ms': 0.0, 'count': 0})
+                entry['ms'] += seconds * 1000
+                entry['count'] += 1
+            logger.info(json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'view': view,
+                'status': response.status_code,
+                'streaming': response.streaming,
+                'ms': round(elapsed * 1000, 3),
+                'stages': {
+                    stage: {'ms': round(entry['ms'], 3), 'count': entry['count']}
+                    for stage, entry in stages.items()
+                },
+            }))
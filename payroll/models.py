@@ -23,6 +23,14 @@ class PaymentToken(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # payment_success: newest usable token of a customer
+            models.Index(fields=['customer_email', 'is_paid', 'is_used', '-created_at']),
+            # Usable or expired tokens by expiry
+            models.Index(fields=['is_paid', 'is_used', 'expires_at']),
+            # purge_expired_tokens range scans
+            models.Index(fields=['expires_at']),
+        ]
     
     def __str__(self):
         return f"Token {self.token} - {'Usado' if self.is_used else 'Pagado' if self.is_paid else 'Pendiente'}"
@@ -41,8 +49,83 @@ class PaymentToken(models.Model):
             timezone.now() < self.expires_at
         )
     
-    def mark_as_used(self):
-        """Marca el token como usado"""
-        self.is_used = True
-        self.used_at = timezone.now()
-        self.save()
\ No newline at end of file
+    @classmethod
+    def usable(cls):
+        """Tokens that are paid, unused and not expired"""
+        return cls.objects.filter(is_paid=True, is_used=False, expires_at__gt=timezone.now())
+    
+    @classmethod
+    def consume(cls, token) -> bool:
+        """
+        Marca el token como usado si todavía es válido, en un solo UPDATE
+        
+        Returns:
+            True si esta llamada lo consumió; False si no existe, no es
+            válido o ya lo consumió otra petición
+        """
+        return cls.usable().filter(token=token).update(
+            is_used=True, used_at=timezone.now()
+        ) == 1
+    
+    @classmethod
+    async def aconsume(cls, token) -> bool:
+        """Versión asíncrona de consume()"""
+        return await cls.usable().filter(token=token).aupdate(
+            is_used=True, used_at=timezone.now()
+        ) == 1
+
+class GenerationJob(models.Model):
+    """Stub generation queued by payroll_view and run by run_payroll_worker"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    token = models.ForeignKey(PaymentToken, on_delete=models.CASCADE, related_name='generation_jobs')
+    inputs = models.JSONField()
+    
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    done = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    result_path = models.CharField(max_length=500, blank=True)
+    error = models.TextField(blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+    
+    def __str__(self):
+        return f"Job {self.id} - {self.status} ({self.done}/{self.total})"
+
+
+class StripeEvent(models.Model):
+    """Ledger of received Stripe webhook events; the unique event_id rejects replays"""
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    # The checkout session fields the update needs, kept so a lost
+    # background update can be redone
+    payload = models.JSONField()
+    
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['processed_at', 'received_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.type} {self.event_id}"
@@ -0,0 +1,94 @@
+"""
+Fixed-point money in integer cents
+"""
+
+# Standard library imports
+from decimal import Decimal
+from fractions import Fraction
+from functools import lru_cache, total_ordering
+from typing import Union
+
+# Local application imports
+from .formatting import format_cents
+
+
+@lru_cache(maxsize=None)
+def _exact_rate(rate: Union[float, str]) -> Fraction:
+    """A rate as the exact decimal it is written as, e.g. 0.062 -> 62/1000"""
+    return Fraction(str(rate))
+
+
+@total_ordering
+class Money:
+    """
+    An amount of money held as integer cents
+
+    Sums and differences are exact. The operations that can produce
+    fractions of a cent round up to the next cent, as payroll does.
+    """
+
+    __slots__ = ('cents',)
+
+    def __init__(self, cents: int = 0):
+        self.cents = cents
+
+    @classmethod
+    def from_amount(cls, amount: Union[int, float, str, Decimal]) -> 'Money':
+        """
+        Build from an amount in dollars
+
+        Floats are read as the decimal they print as, so 0.1 is exactly
+        ten cents.
+        """
+        return cls(int((Decimal(str(amount)) * 100).to_integral_value()))
+
+    def divide_up(self, divisor: int) -> 'Money':
+        """Split into divisor equal parts, rounding up to the cent"""
+        return Money(-(-self.cents // divisor))
+
+    def times_rate_up(self, rate: Union[float, str]) -> 'Money':
+        """Apply a rate such as 0.062, rounding up to the cent"""
+        rate = _exact_rate(rate)
+        return Money(-(-self.cents * rate.numerator // rate.denominator))
+
+    def __add__(self, other: 'Money') -> 'Money':
+        if not isinstance(other, Money):
+            return NotImplemented
+        return Money(self.cents + other.cents)
+
+    def __sub__(self, other: 'Money') -> 'Money':
+        if not isinstance(other, Money):
+            return NotImplemented
+        return Money(self.cents - other.cents)
+
+    def __mul__(self, times: int) -> 'Money':
+        if not isinstance(times, int):
+            return NotImplemented
+        return Money(self.cents * times)
+
+    __rmul__ = __mul__
+
+    def __neg__(self) -> 'Money':
+        return Money(-self.cents)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Money):
+            return NotImplemented
+        return self.cents == other.cents
+
+    def __lt__(self, other: 'Money') -> bool:
+        if not isinstance(other, Money):
+            return NotImplemented
+        return self.cents < other.cents
+
+    def __hash__(self) -> int:
+        return hash(self.cents)
+
+    def __bool__(self) -> bool:
+        return self.cents != 0
+
+    def __str__(self) -> str:
+        return format_cents(self.cents)
+
+    def __repr__(self) -> str:
+        return f"Money('{format_cents(self.cents).replace(',', '')}')"
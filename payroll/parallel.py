@@ -0,0 +1,106 @@
+"""
+Bounded executors for parallel stub generation
+"""
+
+# Standard library imports
+import contextvars
+import threading
+from collections import deque
+from concurrent.futures import (
+    FIRST_EXCEPTION, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+)
+from typing import Callable, Iterable, Iterator, List
+
+# Third-party imports
+from django.conf import settings
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor() -> Executor:
+    """
+    Return the shared executor selected by PAYROLL_PARALLEL_EXECUTOR
+
+    One executor per process is shared by every request, so
+    PAYROLL_PARALLEL_WORKERS caps the total number of busy workers.
+    """
+    kind = settings.PAYROLL_PARALLEL_EXECUTOR
+    with _executors_lock:
+        if kind not in _executors:
+            executor_class = ProcessPoolExecutor if kind == 'process' else ThreadPoolExecutor
+            _executors[kind] = executor_class(max_workers=settings.PAYROLL_PARALLEL_WORKERS)
+        return _executors[kind]
+
+
+def run_ordered(function: Callable, arguments: Iterable[tuple]) -> List:
+    """
+    Call function(*args) for every item, in parallel when enabled
+
+    Args:
+        function: Task to run; must be picklable for the process executor
+        arguments: Argument tuples, one per task
+
+    Returns:
+        The results in the same order as the arguments
+
+    The first task that fails cancels every task that has not started yet,
+    and its exception is raised once the running tasks have finished.
+    """
+    arguments = list(arguments)
+    if settings.PAYROLL_PARALLEL_WORKERS <= 1 or len(arguments) <= 1:
+        return [function(*args) for args in arguments]
+
+    executor = get_executor()
+    futures = [_submit(executor, function, args) for args in arguments]
+    done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+
+    failed = next((future for future in futures if future in done and future.exception()), None)
+    if failed is not None:
+        for future in futures:
+            future.cancel()
+        wait(futures)
+        raise failed.exception()
+
+    return [future.result() for future in futures]
+
+
+def iter_ordered(function: Callable, arguments: Iterable[tuple]) -> Iterator:
+    """
+    Yield function(*args) for every item, in order, as results become ready
+
+    At most PAYROLL_PARALLEL_WORKERS tasks run ahead of the consumer, so a
+    slow consumer holds only that many finished results in memory. A
+    failure, or closing the iterator early, cancels the tasks not started.
+    """
+    if settings.PAYROLL_PARALLEL_WORKERS <= 1:
+        for args in arguments:
+            yield function(*args)
+        return
+
+    executor = get_executor()
+    pending = deque()
+    arguments = iter(arguments)
+    try:
+        for args in arguments:
+            pending.append(_submit(executor, function, args))
+            if len(pending) >= settings.PAYROLL_PARALLEL_WORKERS:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+        wait(pending)
+
+
+def _submit(executor: Executor, function: Callable, args: tuple) -> Future:
+    """
+    Submit one task
+
+    Thread workers run it in a copy of the caller's context, so
+    request-scoped state such as timing spans follows the task.
+    """
+    if isinstance(executor, ThreadPoolExecutor):
+        return executor.submit(contextvars.copy_context().run, function, *args)
+    return executor.submit(function, *args)
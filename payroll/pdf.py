@@ -0,0 +1,161 @@
+"""
+Minimal in-process PDF writer
+"""
+
+# Standard library imports
+import zlib
+from typing import List, Tuple
+
+# Standard 14 fonts need no embedding; resource name -> base font
+FONTS = {
+    'F1': 'Helvetica',
+    'F2': 'Helvetica-Bold',
+}
+
+# Glyph advance widths (1/1000 em) for ASCII 32-126, from the Adobe AFM files
+HELVETICA_WIDTHS = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+
+HELVETICA_BOLD_WIDTHS = [
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+    975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+    333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+    611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+]
+
+DEFAULT_WIDTH = 556
+
+
+def text_width(text: str, size: float, bold: bool = False) -> float:
+    """Width of a string in points when set in Helvetica"""
+    widths = HELVETICA_BOLD_WIDTHS if bold else HELVETICA_WIDTHS
+    total = 0
+    for char in text:
+        code = ord(char) - 32
+        total += widths[code] if 0 <= code < len(widths) else DEFAULT_WIDTH
+    return total * size / 1000
+
+
+def _escape(text: str) -> bytes:
+    """Encode a string as a PDF literal string body"""
+    data = text.encode('cp1252', errors='replace')
+    return data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+class PdfPage:
+    """A page that collects drawing operators"""
+
+    def __init__(self, width: float, height: float):
+        self.width = width
+        self.height = height
+        self._ops: List[bytes] = []
+
+    def text(self, x: float, y: float, text: str, size: float, bold: bool = False):
+        """Draw text with its baseline at (x, y), measured from the top-left corner"""
+        font = 'F2' if bold else 'F1'
+        self._ops.append(
+            b'BT /%s %.2f Tf %.2f %.2f Td (%s) Tj ET' % (
+                font.encode(), size, x, self.height - y, _escape(text)
+            )
+        )
+
+    def line(self, x1: float, y1: float, x2: float, y2: float, width: float = 0.5):
+        """Draw a straight rule between two points"""
+        self._ops.append(
+            b'%.2f w %.2f %.2f m %.2f %.2f l S' % (
+                width, x1, self.height - y1, x2, self.height - y2
+            )
+        )
+
+    def fill_rect(self, x: float, y: float, width: float, height: float,
+                  rgb: Tuple[float, float, float]):
+        """Fill a rectangle whose top-left corner is (x, y)"""
+        self._ops.append(
+            b'q %.3f %.3f %.3f rg %.2f %.2f %.2f %.2f re f Q' % (
+                rgb + (x, self.height - y - height, width, height)
+            )
+        )
+
+    def content(self) -> bytes:
+        """Page content stream"""
+        return b'\n'.join(self._ops)
+
+
+class PdfDocument:
+    """
+    Build a PDF from pages of text, rules and filled rectangles
+
+    Every page shares the same font resources, so a document with many
+    pages carries a single copy of them.
+    """
+
+    def __init__(self):
+        self.pages: List[PdfPage] = []
+
+    def add_page(self, width: float, height: float) -> PdfPage:
+        """Append a blank page of the given size in points"""
+        page = PdfPage(width, height)
+        self.pages.append(page)
+        return page
+
+    def extend(self, other: 'PdfDocument'):
+        """Append the pages of another document; no content is re-rendered"""
+        self.pages.extend(other.pages)
+
+    def to_bytes(self) -> bytes:
+        """Serialize the document"""
+        font_ids = {name: 3 + i for i, name in enumerate(FONTS)}
+        first_page_id = 3 + len(FONTS)
+        page_ids = [first_page_id + 2 * i for i in range(len(self.pages))]
+
+        objects = {
+            1: b'<< /Type /Catalog /Pages 2 0 R >>',
+            2: b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+                b' '.join(b'%d 0 R' % page_id for page_id in page_ids), len(page_ids)
+            ),
+        }
+        for name, object_id in font_ids.items():
+            objects[object_id] = (
+                b'<< /Type /Font /Subtype /Type1 /BaseFont /%s '
+                b'/Encoding /WinAnsiEncoding >>' % FONTS[name].encode()
+            )
+
+        font_resources = b' '.join(
+            b'/%s %d 0 R' % (name.encode(), object_id) for name, object_id in font_ids.items()
+        )
+        for page, page_id in zip(self.pages, page_ids):
+            stream = zlib.compress(page.content())
+            objects[page_id] = (
+                b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.2f %.2f] '
+                b'/Resources << /Font << %s >> >> /Contents %d 0 R >>' % (
+                    page.width, page.height, font_resources, page_id + 1
+                )
+            )
+            objects[page_id + 1] = (
+                b'<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream' % (
+                    len(stream), stream
+                )
+            )
+
+        output = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        offsets = []
+        for object_id in sorted(objects):
+            offsets.append(len(output))
+            output += b'%d 0 obj\n%s\nendobj\n' % (object_id, objects[object_id])
+
+        xref_offset = len(output)
+        output += b'xref\n0 %d\n0000000000 65535 f \n' % (len(offsets) + 1)
+        for offset in offsets:
+            output += b'%010d 00000 n \n' % offset
+        output += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (
+            len(offsets) + 1, xref_offset
+        )
+        return bytes(output)
@@ -0,0 +1,176 @@
+"""
+Pay schedules: pay dates, period numbers and year-to-date totals
+"""
+
+# Standard library imports
+import calendar
+from datetime import datetime, timedelta
+from typing import List, Optional, Sequence, Tuple
+
+# Every weekly and biweekly pay date falls on this Friday's grid
+PAY_DATE_ANCHOR = datetime(2023, 12, 22)
+
+WEEKLY = 'weekly'
+BIWEEKLY = 'biweekly'
+SEMI_MONTHLY = 'semi-monthly'
+MONTHLY = 'monthly'
+
+# Pay periods per year, as posted by the form -> frequency
+FREQUENCIES = {
+    52: WEEKLY,
+    26: BIWEEKLY,
+    24: SEMI_MONTHLY,
+    12: MONTHLY,
+}
+
+STEP_DAYS = {
+    WEEKLY: 7,
+    BIWEEKLY: 14,
+}
+
+
+class PaySchedule:
+    """
+    The pay dates of one request, computed once
+
+    Period numbers count the pay dates of the calendar year up to and
+    including each date, so year-to-date figures restart every January.
+    """
+
+    def __init__(self, frequency: str, dates: List[datetime], numbers: List[int],
+                 previous_dates: List[datetime]):
+        self.frequency = frequency
+        self.dates = dates
+        self.numbers = numbers
+        self.previous_dates = previous_dates
+        self._previous = dict(zip(dates, previous_dates))
+
+    @classmethod
+    def build(cls, start: datetime, end: datetime, periods_per_year: int,
+              max_periods: Optional[int] = None) -> 'PaySchedule':
+        """
+        List the pay dates after start, up to and including end
+
+        Both ends are first moved back onto the schedule.
+
+        Args:
+            start: Start of the requested range
+            end: End of the requested range
+            periods_per_year: 52, 26, 24 or 12
+            max_periods: Stop and fail as soon as the range holds more
+                pay dates than this
+
+        Raises:
+            ValueError: For any other number of periods, a range holding
+                more than max_periods pay dates, or dates the schedule
+                cannot step past without leaving the calendar
+        """
+        frequency = check_frequency(periods_per_year)
+
+        dates, numbers, previous_dates = [], [], []
+        try:
+            start = cls.snap(start, frequency)
+            end = cls.snap(end, frequency)
+
+            previous = start
+            date = cls._next(start, frequency)
+            number = cls._number_in_year(date, frequency)
+            while date <= end:
+                if max_periods is not None and len(dates) == max_periods:
+                    raise ValueError(f"The date range holds more than {max_periods} pay dates")
+                dates.append(date)
+                numbers.append(number)
+                previous_dates.append(previous)
+
+                previous = date
+                date = cls._next(date, frequency)
+                number = 1 if date.year != previous.year else number + 1
+        except OverflowError:
+            raise ValueError("The date range reaches past the supported calendar")
+
+        return cls(frequency, dates, numbers, previous_dates)
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def ytd_totals(self, amounts: Sequence[int]) -> List[Tuple[int, ...]]:
+        """
+        Running year-to-date totals of per-period amounts, in one pass
+
+        Args:
+            amounts: Per-period amounts in integer cents
+
+        Returns:
+            For every pay date, the year-to-date total of each amount in cents
+        """
+        totals = []
+        running = None
+        for number in self.numbers:
+            if running is None or number == 1:
+                # The first date of the range may be mid-year
+                running = [amount * number for amount in amounts]
+            else:
+                running = [total + amount for total, amount in zip(running, amounts)]
+            totals.append(tuple(running))
+        return totals
+
+    def previous(self, date: datetime) -> datetime:
+        """The pay date before one of the schedule's dates"""
+        return self._previous[date]
+
+    @staticmethod
+    def snap(date: datetime, frequency: str = BIWEEKLY) -> datetime:
+        """Move a date back to the latest pay date on or before it"""
+        if frequency in STEP_DAYS:
+            step = STEP_DAYS[frequency]
+            return PAY_DATE_ANCHOR + timedelta(days=(date - PAY_DATE_ANCHOR).days // step * step)
+
+        month_end = _month_end(date.year, date.month)
+        if date.day == month_end.day:
+            return month_end
+        if frequency == SEMI_MONTHLY and date.day >= 15:
+            return date.replace(day=15)
+        # Back to the end of the previous month
+        return date.replace(day=1) - timedelta(days=1)
+
+    @staticmethod
+    def _next(date: datetime, frequency: str) -> datetime:
+        """The pay date after a date that is on the schedule"""
+        if frequency in STEP_DAYS:
+            return date + timedelta(days=STEP_DAYS[frequency])
+
+        if frequency == SEMI_MONTHLY and date.day == 15:
+            return _month_end(date.year, date.month)
+        year, month = (date.year + 1, 1) if date.month == 12 else (date.year, date.month + 1)
+        return datetime(year, month, 15) if frequency == SEMI_MONTHLY else _month_end(year, month)
+
+    @staticmethod
+    def _number_in_year(date: datetime, frequency: str) -> int:
+        """How many pay dates of date's year fall on or before it"""
+        if frequency in STEP_DAYS:
+            first = PaySchedule.snap(datetime(date.year, 1, 1) - timedelta(days=1), frequency)
+            return (date - first).days // STEP_DAYS[frequency]
+        if frequency == SEMI_MONTHLY:
+            return 2 * (date.month - 1) + (1 if date.day == 15 else 2)
+        return date.month
+
+
+def check_frequency(periods_per_year: int) -> str:
+    """
+    Return the frequency of a number of pay periods per year
+
+    Raises:
+        ValueError: When the number is not 52, 26, 24 or 12
+    """
+    if periods_per_year not in FREQUENCIES:
+        raise ValueError(
+            f"Unsupported pay period {periods_per_year}; use one of "
+            f"{', '.join(str(number) for number in FREQUENCIES)}"
+        )
+    return FREQUENCIES[periods_per_year]
+
+
+def _month_end(year: int, month: int) -> datetime:
+    """The last day of a month"""
+    return datetime(year, month, calendar.monthrange(year, month)[1])
+
@@ -0,0 +1,183 @@
+"""
+Content-addressed disk cache of rendered stub PDFs
+"""
+
+# Standard library imports
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Dict, Optional, Tuple
+
+# Third-party imports
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# Bump when a code change alters the rendered output for the same inputs
+CACHE_VERSION = 1
+
+# Eviction frees space down to this fraction of max_bytes, so the
+# directory is walked once per that much new data, not on every put
+LOW_WATER = 0.9
+
+
+class StubCache:
+    """
+    Store PDF bytes under the hash of everything that produced them
+
+    Each entry is a file named by its key. Reading an entry touches its
+    mtime, so when the directory grows past max_bytes the entries with the
+    oldest mtime are the least recently used and are evicted first, until
+    the cache is back under LOW_WATER of max_bytes. The total size is
+    counted once and then kept up to date on every put.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        self._template_hashes: Dict[str, Tuple[float, str]] = {}
+        self._lock = threading.Lock()
+
+    def key(self, replacements: Dict[str, str], template_path: str, backend: str) -> str:
+        """
+        Hash the inputs of one stub
+
+        Args:
+            replacements: Placeholder values of the stub
+            template_path: DOCX template the stub is rendered from
+            backend: Render backend, and for DOCX the converter, since
+                each produces different PDFs
+        """
+        digest = hashlib.sha256()
+        digest.update(json.dumps(replacements, sort_keys=True).encode())
+        digest.update(self._template_hash(template_path).encode())
+        digest.update(f'{backend}:{CACHE_VERSION}'.encode())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the cached PDF for a key, or None"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as cached_file:
+                data = cached_file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes):
+        """Store a PDF, evicting the least recently used entries when full"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+
+        # Write under a temporary name so readers never see a partial file
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(data)
+        try:
+            replaced = os.path.getsize(path)
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(temp_path, path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += len(data) - replaced
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def stats(self) -> Dict[str, int]:
+        """Hit and miss counts of this process"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+    def _evict(self):
+        """Delete the oldest entries until the cache is under its low-water mark"""
+        entries = sorted(self._entries())
+        self._size = sum(size for _, size, _ in entries)
+        target = self.max_bytes * LOW_WATER
+        for _, size, path in entries:
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+
+    def _entries(self):
+        """Yield (mtime, size, path) for every cached PDF"""
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith('.pdf'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def _path(self, key: str) -> str:
+        """Spread entries over subdirectories named by the key prefix"""
+        return os.path.join(self.directory, key[:2], f'{key}.pdf')
+
+    def _template_hash(self, template_path: str) -> str:
+        """Hash of the template's bytes, recomputed when the file changes"""
+        template_path = os.path.abspath(template_path)
+        mtime = os.path.getmtime(template_path)
+
+        with self._lock:
+            entry = self._template_hashes.get(template_path)
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+
+        with open(template_path, 'rb') as template_file:
+            template_hash = hashlib.sha256(template_file.read()).hexdigest()
+        with self._lock:
+            self._template_hashes[template_path] = (mtime, template_hash)
+        return template_hash
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_stub_cache() -> Optional[StubCache]:
+    """
+    Return the shared cache, or None when PAYROLL_STUB_CACHE is off
+
+    Placeholder PDFs from the fake converter are never cached, so they
+    cannot be served later in place of converted ones.
+
+    Raises:
+        ImproperlyConfigured: When the cache is on without a directory
+    """
+    global _cache
+
+    if not settings.PAYROLL_STUB_CACHE:
+        return None
+    if settings.PAYROLL_RENDER_BACKEND != 'native' and settings.PAYROLL_CONVERTER == 'fake':
+        return None
+    if not settings.PAYROLL_STUB_CACHE_DIR:
+        raise ImproperlyConfigured("PAYROLL_STUB_CACHE needs a private PAYROLL_STUB_CACHE_DIR")
+
+    with _cache_lock:
+        if _cache is None:
+            os.makedirs(settings.PAYROLL_STUB_CACHE_DIR, mode=0o700, exist_ok=True)
+            _cache = StubCache(
+                settings.PAYROLL_STUB_CACHE_DIR,
+                settings.PAYROLL_STUB_CACHE_MAX_BYTES,
+            )
+        return _cache
@@ -1,3 +1,857 @@
-from django.test import TestCase
+"""
+Property tests of the money, formatting and schedule arithmetic, and tests
+of the generation pipeline, payments and jobs around it
+"""
 
-# Create your tests here.
+# Standard library imports
+import asyncio
+import csv
+import io
+import math
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from datetime import datetime, timedelta
+from fractions import Fraction
+from unittest import mock
+
+# Third-party imports
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from docx import Document
+
+# Local application imports
+from . import parallel, stub_cache
+from .admission import AdmissionController
+from .formatting import decimal_part, format_cents, format_cents_many, number_to_words
+from .jobs import claim_next_job, requeue_stale_jobs, run_job
+from .models import GenerationJob, PaymentToken, StripeEvent
+from .money import Money
+from .parallel import iter_ordered, run_ordered
+from .schedule import FREQUENCIES, PaySchedule
+from .stub_cache import StubCache, get_stub_cache
+from .views import (
+    MEDICARE_RATE, SOCIAL_SECURITY_RATE, TEMPLATE_PATH, BulkPayrollGenerator, PayrollCalculator,
+    PayrollDocumentGenerator
+)
+from .webhooks import apply_event, process_pending_events, record_event
+
+SEED = 20240105
+SAMPLES = 2000
+
+# One employee's form, as posted to payroll_view
+STUB_INPUTS = {
+    'name': 'John', 'last_name': 'Doe', 'client_address': '1 Main St',
+    'city_state': 'Miami, FL', 'company': 'ACME', 'address_co': '2 Side St',
+    'check_id': '1001', 'ssn_digits': '1234', 'dependents': '2',
+    'anual': '85000', 'period': '26',
+    'start_period': '2024-01-05', 'end_period': '2024-03-29',
+}
+
+
+def exact_round_up(value: Fraction) -> int:
+    """Round a dollar amount up to whole cents, exactly"""
+    return math.ceil(value * 100)
+
+
+def legacy_round_up(number: float) -> float:
+    """The float rounding the calculator used before Money"""
+    return math.ceil(number * 100) / 100
+
+
+def legacy_calculate(annual_salary: int, pay_period: int):
+    """The float calculation the calculator used before Money"""
+    gross_salary = legacy_round_up(annual_salary / pay_period)
+    fed_withholding = legacy_round_up(gross_salary * PayrollCalculator._get_tax_rate(annual_salary))
+    ss = legacy_round_up(gross_salary * SOCIAL_SECURITY_RATE)
+    medicare = legacy_round_up(gross_salary * MEDICARE_RATE)
+    return gross_salary, fed_withholding, ss, medicare
+
+
+class MoneyCalculationTests(SimpleTestCase):
+    """PayrollCalculator agrees with exact arithmetic and with the old floats where they were right"""
+
+    def setUp(self):
+        self.random = random.Random(SEED)
+
+    def _salaries(self):
+        for _ in range(SAMPLES):
+            yield self.random.randint(0, 1_000_000), self.random.choice(list(FREQUENCIES))
+
+    def test_matches_exact_arithmetic(self):
+        for annual_salary, pay_period in self._salaries():
+            gross, fed, ss, medicare, fica = PayrollCalculator.calculate(annual_salary, pay_period)
+            rate = Fraction(str(PayrollCalculator._get_tax_rate(annual_salary)))
+
+            self.assertEqual(gross.cents, exact_round_up(Fraction(annual_salary, pay_period)))
+            self.assertEqual(fed.cents, exact_round_up(Fraction(gross.cents, 100) * rate))
+            self.assertEqual(ss.cents, exact_round_up(Fraction(gross.cents, 100) * Fraction('0.062')))
+            self.assertEqual(medicare.cents, exact_round_up(Fraction(gross.cents, 100) * Fraction('0.0145')))
+            self.assertEqual(fica, fed + ss + medicare)
+
+    def test_matches_legacy_floats_away_from_cent_boundaries(self):
+        for annual_salary, pay_period in self._salaries():
+            money = PayrollCalculator.calculate(annual_salary, pay_period)[:4]
+            legacy = legacy_calculate(annual_salary, pay_period)
+            if any(Money.from_amount(value).cents != amount.cents
+                   for value, amount in zip(legacy, money)):
+                # Floats only drift where the exact value lands on a whole
+                # cent and the product comes out a hair above it
+                gross = Fraction(money[0].cents, 100)
+                exact = [Fraction(annual_salary, pay_period)] + [
+                    gross * Fraction(str(rate)) for rate in (
+                        PayrollCalculator._get_tax_rate(annual_salary),
+                        SOCIAL_SECURITY_RATE, MEDICARE_RATE
+                    )
+                ]
+                self.assertTrue(any((value * 100).denominator == 1 for value in exact))
+
+    def test_known_float_drift_is_fixed(self):
+        # 1.1 * 100 is 110.00000000000001 in floats, which ceil pushed to 1.11
+        self.assertEqual(legacy_round_up(1.1), 1.11)
+        self.assertEqual(Money.from_amount(1.1).divide_up(1), Money(110))
+
+    def test_batch_matches_calculate(self):
+        salaries = list(self._salaries())
+        batch = PayrollCalculator.calculate_batch(
+            [salary for salary, _ in salaries], [period for _, period in salaries]
+        )
+        for i, (annual_salary, pay_period) in enumerate(salaries):
+            expected = [amount.cents for amount in PayrollCalculator.calculate(annual_salary, pay_period)]
+            self.assertEqual([int(column[i]) for column in batch], expected)
+
+
+class MoneyArithmeticTests(SimpleTestCase):
+    """Money behaves like the integers it holds"""
+
+    def setUp(self):
+        self.random = random.Random(SEED)
+
+    def test_sums_are_exact(self):
+        for _ in range(SAMPLES):
+            a, b, c = (Money(self.random.randint(-10 ** 9, 10 ** 9)) for _ in range(3))
+            self.assertEqual((a + b) + c, a + (b + c))
+            self.assertEqual(a + b - b, a)
+            self.assertEqual(a * 3, a + a + a)
+            self.assertEqual(3 * a, a * 3)
+
+    def test_divide_up_never_loses_a_cent(self):
+        for _ in range(SAMPLES):
+            amount = Money(self.random.randint(0, 10 ** 9))
+            divisor = self.random.randint(1, 400)
+            part = amount.divide_up(divisor)
+            self.assertGreaterEqual(part * divisor, amount)
+            self.assertLess((part - Money(1)) * divisor, amount)
+
+    def test_from_amount_reads_the_printed_decimal(self):
+        for _ in range(SAMPLES):
+            cents = self.random.randint(-10 ** 9, 10 ** 9)
+            amount = float(f"{cents / 100:.2f}")
+            self.assertEqual(Money.from_amount(amount).cents, cents)
+            self.assertEqual(Money.from_amount(str(Money(cents)).replace(',', '')).cents, cents)
+
+    def test_equal_money_hashes_equal(self):
+        self.assertEqual({Money(5), Money(5)}, {Money(5)})
+        self.assertLess(Money(4), Money(5))
+        self.assertFalse(Money(0))
+
+
+class FormattingTests(SimpleTestCase):
+    """Currency strings and amounts in words"""
+
+    def setUp(self):
+        self.random = random.Random(SEED)
+
+    def test_format_cents_matches_float_formatting(self):
+        column = [self.random.randint(-10 ** 11, 10 ** 11) for _ in range(SAMPLES)]
+        for cents, text in zip(column, format_cents_many(column)):
+            self.assertEqual(text, "{:,.2f}".format(cents / 100))
+            self.assertEqual(text, format_cents(cents))
+            self.assertEqual(decimal_part(cents), text[-2:])
+
+    def test_decimal_part_of_awkward_floats(self):
+        self.assertEqual(decimal_part(Money.from_amount(1234.1).cents), '10')
+        self.assertEqual(decimal_part(Money.from_amount(1e-05).cents), '00')
+
+    def test_words_read_in_groups_of_thousands(self):
+        for _ in range(SAMPLES):
+            high, low = self.random.randint(1, 999), self.random.randint(0, 999)
+            words = number_to_words(high * 1000 + low)
+            expected = f"{number_to_words(high)} THOUSAND"
+            if low:
+                expected = f"{expected} {number_to_words(low)}"
+            self.assertEqual(words, expected)
+
+    def test_words_of_whole_millions(self):
+        self.assertEqual(number_to_words(1_000_000), "ONE MILLION")
+        self.assertEqual(number_to_words(12_000_005), "TWELVE MILLION FIVE")
+        with self.assertRaises(ValueError):
+            number_to_words(-1)
+
+
+class ScheduleTests(SimpleTestCase):
+    """Pay dates and year-to-date totals"""
+
+    def setUp(self):
+        self.random = random.Random(SEED)
+
+    def test_ytd_is_period_number_times_amount(self):
+        for _ in range(200):
+            start = datetime(self.random.randint(2023, 2030), self.random.randint(1, 12), self.random.randint(1, 28))
+            end = datetime(start.year + self.random.randint(0, 2), self.random.randint(1, 12), 28)
+            schedule = PaySchedule.build(start, end, self.random.choice(list(FREQUENCIES)))
+            amounts = [self.random.randint(0, 10 ** 6) for _ in range(3)]
+
+            for number, totals in zip(schedule.numbers, schedule.ytd_totals(amounts)):
+                self.assertEqual(list(totals), [amount * number for amount in amounts])
+
+    def test_full_years_are_numbered_from_one(self):
+        for periods_per_year in FREQUENCIES:
+            for year in range(2024, 2031):
+                schedule = PaySchedule.build(datetime(year - 1, 12, 31), datetime(year, 12, 31), periods_per_year)
+                numbers = [number for date, number in zip(schedule.dates, schedule.numbers) if date.year == year]
+                self.assertEqual(numbers, list(range(1, len(numbers) + 1)))
+                self.assertIn(len(numbers), (periods_per_year, periods_per_year + 1))
+
+    def test_max_periods_stops_early(self):
+        for periods_per_year in FREQUENCIES:
+            start, end = datetime(2023, 12, 31), datetime(2024, 12, 31)
+            full = PaySchedule.build(start, end, periods_per_year)
+            self.assertEqual(len(PaySchedule.build(start, end, periods_per_year, max_periods=len(full))),
+                             len(full))
+            with self.assertRaisesMessage(ValueError, f"more than {len(full) - 1} pay dates"):
+                PaySchedule.build(start, end, periods_per_year, max_periods=len(full) - 1)
+
+        started = time.perf_counter()
+        with self.assertRaises(ValueError):
+            PaySchedule.build(datetime(1900, 1, 8), datetime(9999, 12, 20), 52, max_periods=120)
+        self.assertLess(time.perf_counter() - started, 0.1)
+
+    def test_calendar_limits_are_value_errors(self):
+        for start, end in ((datetime(1, 1, 8), datetime(1, 3, 1)),
+                           (datetime(9999, 12, 1), datetime(9999, 12, 31))):
+            for periods_per_year in FREQUENCIES:
+                with self.subTest(start=start, periods_per_year=periods_per_year):
+                    try:
+                        PaySchedule.build(start, end, periods_per_year)
+                    except ValueError:
+                        pass
+
+
+class StreamingZipTests(SimpleTestCase):
+    """The streamed archive is a valid ZIP with the entries in the order given"""
+
+    def setUp(self):
+        self.random = random.Random(SEED)
+        self.pdfs = [
+            (f'stub_{i:02d}.pdf', self.random.randbytes(self.random.randint(0, 20_000)))
+            for i in range(12)
+        ]
+
+    def test_entries_round_trip_in_order(self):
+        for compression in ('stored', 'deflated'):
+            with self.subTest(compression=compression), \
+                    override_settings(PAYROLL_ZIP_COMPRESSION=compression):
+                response = PayrollDocumentGenerator.create_streaming_zip_response(iter(self.pdfs))
+                body = b''.join(response.streaming_content)
+
+                with zipfile.ZipFile(io.BytesIO(body)) as archive:
+                    self.assertIsNone(archive.testzip())
+                    self.assertEqual(archive.namelist(), [name for name, _ in self.pdfs])
+                    for name, data in self.pdfs:
+                        self.assertEqual(archive.read(name), data)
+
+    def test_empty_archive_is_valid(self):
+        response = PayrollDocumentGenerator.create_streaming_zip_response(iter([]))
+        body = b''.join(response.streaming_content)
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            self.assertEqual(archive.namelist(), [])
+
+
+@override_settings(PAYROLL_PARALLEL_WORKERS=2, PAYROLL_PARALLEL_EXECUTOR='thread')
+class ParallelTests(SimpleTestCase):
+    """Ordered results, and no new tasks started after a failure"""
+
+    TASKS = 50
+
+    def setUp(self):
+        self.started = []
+        self.lock = threading.Lock()
+        # A private executor, sized by the settings above rather than by
+        # whichever test created the shared one first
+        executors = mock.patch.object(parallel, '_executors', {})
+        executors.start()
+        self.addCleanup(executors.stop)
+        self.addCleanup(self._shutdown_executors)
+
+    @staticmethod
+    def _shutdown_executors():
+        for executor in parallel._executors.values():
+            executor.shutdown()
+
+    def _task(self, number: int) -> int:
+        with self.lock:
+            self.started.append(number)
+        if number == 3:
+            raise ValueError("task 3 failed")
+        time.sleep(0.01)
+        return number * 2
+
+    def _arguments(self, first: int = 0):
+        return [(number,) for number in range(first, self.TASKS)]
+
+    def test_run_ordered_keeps_order(self):
+        self.assertEqual(run_ordered(self._task, self._arguments(4)),
+                         [number * 2 for number in range(4, self.TASKS)])
+
+    def test_run_ordered_cancels_on_failure(self):
+        with self.assertRaisesMessage(ValueError, "task 3 failed"):
+            run_ordered(self._task, self._arguments())
+        self.assertLess(len(self.started), self.TASKS)
+
+    def test_iter_ordered_cancels_on_failure(self):
+        results = iter_ordered(self._task, self._arguments())
+        self.assertEqual([next(results) for _ in range(3)], [0, 2, 4])
+        with self.assertRaisesMessage(ValueError, "task 3 failed"):
+            next(results)
+        self.assertLess(len(self.started), self.TASKS)
+
+    def test_iter_ordered_cancels_when_closed(self):
+        results = iter_ordered(self._task, self._arguments(4))
+        self.assertEqual(next(results), 8)
+        results.close()
+        started = len(self.started)
+        time.sleep(0.05)
+        self.assertEqual(len(self.started), started)
+        self.assertLess(started, self.TASKS)
+
+
+class StubCacheTests(SimpleTestCase):
+    """Least recently used entries are evicted first, down to the low-water mark"""
+
+    ENTRY_BYTES = 1000
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache = StubCache(directory.name, max_bytes=10 * self.ENTRY_BYTES)
+
+    def _key(self, number: int) -> str:
+        return f'{number:064x}'
+
+    def _fill(self, count: int):
+        """Store count entries, each one last used a second after the one before"""
+        now = time.time()
+        for number in range(count):
+            self.cache.put(self._key(number), bytes([number]) * self.ENTRY_BYTES)
+            used_at = now - 1000 + number
+            os.utime(self.cache._path(self._key(number)), (used_at, used_at))
+
+    def _stored_bytes(self) -> int:
+        return sum(size for _, size, _ in self.cache._entries())
+
+    def test_get_returns_what_was_put(self):
+        self._fill(3)
+        self.assertEqual(self.cache.get(self._key(1)), bytes([1]) * self.ENTRY_BYTES)
+        self.assertIsNone(self.cache.get(self._key(7)))
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 1})
+
+    def test_evicts_least_recently_used(self):
+        self._fill(10)
+        # Reading the oldest entry makes it the most recently used
+        self.assertIsNotNone(self.cache.get(self._key(0)))
+
+        self.cache.put(self._key(10), b'x' * self.ENTRY_BYTES)
+
+        self.assertIsNotNone(self.cache.get(self._key(0)))
+        self.assertIsNone(self.cache.get(self._key(1)))
+        self.assertIsNone(self.cache.get(self._key(2)))
+        for number in range(3, 11):
+            self.assertIsNotNone(self.cache.get(self._key(number)))
+        self.assertLessEqual(self._stored_bytes(), 9 * self.ENTRY_BYTES)
+
+    def test_overwrite_does_not_count_twice(self):
+        self._fill(10)
+        for _ in range(5):
+            self.cache.put(self._key(9), b'y' * self.ENTRY_BYTES)
+        self.assertEqual(self._stored_bytes(), 10 * self.ENTRY_BYTES)
+        self.assertIsNotNone(self.cache.get(self._key(0)))
+
+    def test_key_depends_on_backend(self):
+        template = os.path.join(self.cache.directory, 'template.docx')
+        with open(template, 'wb') as template_file:
+            template_file.write(b'template')
+        replacements = {'{employee_name}': 'Jane Doe'}
+
+        keys = {
+            self.cache.key(replacements, template, backend)
+            for backend in ('native', 'libreoffice:subprocess', 'libreoffice:uno')
+        }
+        self.assertEqual(len(keys), 3)
+        self.assertEqual(self.cache.key(replacements, template, 'native'),
+                         self.cache.key(dict(replacements), template, 'native'))
+
+
+class GetStubCacheTests(SimpleTestCase):
+    """The shared cache is only built when it is on, private and not fed fake PDFs"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = os.path.join(directory.name, 'stubs')
+        cache = mock.patch.object(stub_cache, '_cache', None)
+        cache.start()
+        self.addCleanup(cache.stop)
+
+    def test_off_by_default(self):
+        with override_settings(PAYROLL_STUB_CACHE_DIR=self.directory):
+            self.assertIsNone(get_stub_cache())
+
+    def test_fake_converter_is_never_cached(self):
+        with override_settings(PAYROLL_STUB_CACHE=True, PAYROLL_STUB_CACHE_DIR=self.directory,
+                               PAYROLL_RENDER_BACKEND='libreoffice', PAYROLL_CONVERTER='fake'):
+            self.assertIsNone(get_stub_cache())
+        with override_settings(PAYROLL_STUB_CACHE=True, PAYROLL_STUB_CACHE_DIR=self.directory,
+                               PAYROLL_RENDER_BACKEND='native', PAYROLL_CONVERTER='fake'):
+            self.assertIsNotNone(get_stub_cache())
+
+    def test_needs_a_directory(self):
+        with override_settings(PAYROLL_STUB_CACHE=True, PAYROLL_STUB_CACHE_DIR=None,
+                               PAYROLL_RENDER_BACKEND='native'):
+            with self.assertRaises(ImproperlyConfigured):
+                get_stub_cache()
+
+    def test_directory_is_private(self):
+        with override_settings(PAYROLL_STUB_CACHE=True, PAYROLL_STUB_CACHE_DIR=self.directory,
+                               PAYROLL_RENDER_BACKEND='native'):
+            cache = get_stub_cache()
+        self.assertEqual(cache.directory, self.directory)
+        self.assertEqual(os.stat(self.directory).st_mode & 0o777, 0o700)
+
+
+class AdmissionTests(SimpleTestCase):
+    """A streamed body holds its slot until it is exhausted or closed"""
+
+    def setUp(self):
+        self.controller = AdmissionController(limit=1, wait=0)
+        self.assertTrue(self.controller.acquire())
+
+    def test_release_on_close(self):
+        body = self.controller.release_after(iter([b'a', b'b']))
+        self.assertEqual(next(body), b'a')
+        self.assertFalse(self.controller.acquire())
+
+        body.close()
+        self.assertTrue(self.controller.acquire())
+
+    def test_release_on_exhaustion(self):
+        body = self.controller.release_after(iter([b'a', b'b']))
+        self.assertEqual(list(body), [b'a', b'b'])
+        self.assertTrue(self.controller.acquire())
+        self.controller.release()
+
+        # Django still closes the response; the slot is not given back twice
+        body.close()
+        self.assertTrue(self.controller.acquire())
+        self.assertFalse(self.controller.acquire())
+
+    def test_release_on_failure(self):
+        def failing():
+            yield b'a'
+            raise RuntimeError("render failed")
+
+        body = self.controller.release_after(failing())
+        with self.assertRaises(RuntimeError):
+            list(body)
+        self.assertTrue(self.controller.acquire())
+
+
+class CompiledTemplateTests(SimpleTestCase):
+    """Filling the compiled template gives the document the replacements used to"""
+
+    def test_fill_matches_apply_replacements(self):
+        inputs = {
+            'name': 'John', 'last_name': 'Doe', 'client_address': '1 Main St',
+            'city_state': 'Miami, FL', 'company': 'ACME', 'address_co': '2 Side St',
+            'check_id': '1001', 'ssn_digits': '1234', 'dependents': '2',
+            'anual': '85000', 'period': '26',
+            'start_period': '2024-01-05', 'end_period': '2024-03-29',
+        }
+        generator = PayrollDocumentGenerator(inputs, PayrollCalculator.calculate(85000, 26))
+
+        for _, start_period, payment_number in generator.get_periods():
+            replacements = generator._get_replacements(start_period, payment_number)
+            compiled = generator._get_compiled_template(replacements).fill(replacements)
+            legacy = Document(TEMPLATE_PATH)
+            generator._apply_replacements(legacy, replacements)
+
+            self.assertEqual(compiled.element.body.xml, legacy.element.body.xml)
+
+
+class PaymentTokenTests(TestCase):
+    """A paid token is spent exactly once, and only while it is usable"""
+
+    def _token(self, **fields) -> PaymentToken:
+        fields.setdefault('is_paid', True)
+        return PaymentToken.objects.create(stripe_session_id=str(uuid.uuid4()), **fields)
+
+    def test_consume_spends_once(self):
+        token = self._token()
+        self.assertTrue(PaymentToken.consume(token.token))
+        self.assertFalse(PaymentToken.consume(token.token))
+
+        token.refresh_from_db()
+        self.assertTrue(token.is_used)
+        self.assertIsNotNone(token.used_at)
+
+    async def test_second_submission_loses(self):
+        token = await sync_to_async(self._token)()
+        results = await asyncio.gather(
+            PaymentToken.aconsume(token.token), PaymentToken.aconsume(token.token)
+        )
+        self.assertEqual(sorted(results), [False, True])
+
+    def test_unusable_tokens_are_not_consumed(self):
+        tokens = {
+            'unpaid': self._token(is_paid=False),
+            'used': self._token(is_used=True),
+            'expired': self._token(expires_at=timezone.now() - timedelta(minutes=1)),
+        }
+        for reason, token in tokens.items():
+            with self.subTest(reason):
+                self.assertFalse(PaymentToken.consume(token.token))
+                self.assertFalse(PaymentToken.usable().filter(pk=token.pk).exists())
+        self.assertFalse(PaymentToken.consume(uuid.uuid4()))
+
+
+@override_settings(PAYROLL_ASYNC_JOBS=True)
+class PayrollViewTokenTests(TestCase):
+    """The view checks the token before the input, and spends it only on valid input"""
+
+    def setUp(self):
+        self.token = PaymentToken.objects.create(stripe_session_id='session', is_paid=True)
+        self.url = reverse('payroll', args=[self.token.token])
+
+    def test_unknown_token_redirects(self):
+        response = self.client.post(reverse('payroll', args=['not-a-token']), STUB_INPUTS)
+        self.assertRedirects(response, reverse('index'), fetch_redirect_response=False)
+        response = self.client.post(reverse('payroll', args=[uuid.uuid4()]), STUB_INPUTS)
+        self.assertRedirects(response, reverse('index'), fetch_redirect_response=False)
+
+    def test_bad_input_keeps_token(self):
+        for inputs in (dict(STUB_INPUTS, end_period='not a date'),
+                       dict(STUB_INPUTS, end_period=STUB_INPUTS['start_period'])):
+            with self.subTest(inputs['end_period']):
+                self.assertEqual(self.client.post(self.url, inputs).status_code, 400)
+        self.token.refresh_from_db()
+        self.assertFalse(self.token.is_used)
+
+    def test_second_submission_redirects(self):
+        self.assertEqual(self.client.post(self.url, STUB_INPUTS).status_code, 202)
+        response = self.client.post(self.url, STUB_INPUTS)
+        self.assertRedirects(response, reverse('index'), fetch_redirect_response=False)
+        self.assertEqual(GenerationJob.objects.filter(token=self.token).count(), 1)
+
+
+class StripeEventTests(TestCase):
+    """Each webhook event is recorded once and applied to its token once"""
+
+    def setUp(self):
+        self.token = PaymentToken.objects.create(stripe_session_id='cs_test_1')
+
+    def _event(self, event_id: str = 'evt_1', event_type: str = 'checkout.session.completed',
+               payment_status: str = 'paid') -> dict:
+        session = {
+            'id': 'cs_test_1',
+            'payment_status': payment_status,
+            'customer_details': {'email': 'jane@example.com'},
+        }
+        return {'id': event_id, 'type': event_type, 'data': {'object': session}}
+
+    def test_duplicate_event_is_rejected(self):
+        stripe_event = record_event(self._event())
+        self.assertEqual(stripe_event.payload, {
+            'id': 'cs_test_1', 'payment_status': 'paid', 'email': 'jane@example.com',
+        })
+        self.assertIsNone(stripe_event.processed_at)
+
+        self.assertIsNone(record_event(self._event()))
+        self.assertEqual(StripeEvent.objects.filter(event_id='evt_1').count(), 1)
+
+    def test_unhandled_event_is_already_processed(self):
+        stripe_event = record_event(self._event(event_type='invoice.paid'))
+        self.assertEqual(stripe_event.payload, {})
+        self.assertIsNotNone(stripe_event.processed_at)
+
+    def test_apply_event_marks_token_paid_once(self):
+        stripe_event = record_event(self._event())
+        apply_event(stripe_event.pk)
+
+        self.token.refresh_from_db()
+        stripe_event.refresh_from_db()
+        self.assertTrue(self.token.is_paid)
+        self.assertEqual(self.token.customer_email, 'jane@example.com')
+        self.assertIsNotNone(stripe_event.processed_at)
+
+        paid_at, processed_at = self.token.paid_at, stripe_event.processed_at
+        apply_event(stripe_event.pk)
+        self.token.refresh_from_db()
+        stripe_event.refresh_from_db()
+        self.assertEqual(self.token.paid_at, paid_at)
+        self.assertEqual(stripe_event.processed_at, processed_at)
+
+    def test_unpaid_session_leaves_token_unpaid(self):
+        stripe_event = record_event(self._event(payment_status='unpaid'))
+        apply_event(stripe_event.pk)
+
+        self.token.refresh_from_db()
+        stripe_event.refresh_from_db()
+        self.assertFalse(self.token.is_paid)
+        self.assertIsNotNone(stripe_event.processed_at)
+
+    def test_pending_events_are_applied_when_old_enough(self):
+        old = record_event(self._event('evt_old'))
+        StripeEvent.objects.filter(pk=old.pk).update(
+            received_at=timezone.now() - timedelta(minutes=5)
+        )
+        new = record_event(self._event('evt_new'))
+
+        self.assertEqual(process_pending_events(older_than=60), 1)
+        self.assertIsNotNone(StripeEvent.objects.get(pk=old.pk).processed_at)
+        self.assertIsNone(StripeEvent.objects.get(pk=new.pk).processed_at)
+        self.token.refresh_from_db()
+        self.assertTrue(self.token.is_paid)
+
+
+class PurgeExpiredTokensTests(TestCase):
+    """Only tokens past the retention window are deleted, a batch at a time"""
+
+    RETENTION_DAYS = 7
+
+    def setUp(self):
+        now = timezone.now()
+        self.purged = [
+            self._token(f'old_{i}', now - timedelta(days=self.RETENTION_DAYS + 5 - i))
+            for i in range(5)
+        ]
+        self.kept = [
+            self._token('recently_expired', now - timedelta(days=1)),
+            self._token('valid', now + timedelta(hours=1)),
+        ]
+
+    def _token(self, session_id: str, expires_at: datetime) -> PaymentToken:
+        return PaymentToken.objects.create(
+            stripe_session_id=session_id, is_paid=True, expires_at=expires_at
+        )
+
+    def _purge(self, **options) -> str:
+        stdout = io.StringIO()
+        call_command('purge_expired_tokens', retention_days=self.RETENTION_DAYS, batch_size=2,
+                     sleep=0, stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def _remaining(self) -> set:
+        return set(PaymentToken.objects.values_list('stripe_session_id', flat=True))
+
+    def test_deletes_expired_tokens_in_batches(self):
+        with CaptureQueriesContext(connection) as queries:
+            output = self._purge()
+
+        self.assertIn("Deleted 5 token(s)", output)
+        self.assertEqual(self._remaining(), {token.stripe_session_id for token in self.kept})
+        deletes = [
+            query for query in queries
+            if query['sql'].startswith('DELETE') and 'payroll_paymenttoken' in query['sql']
+        ]
+        self.assertEqual(len(deletes), 3)
+
+    def test_max_batches_deletes_oldest_first(self):
+        output = self._purge(max_batches=1)
+
+        self.assertIn("Deleted 2 token(s)", output)
+        self.assertEqual(
+            self._remaining(),
+            {token.stripe_session_id for token in self.purged[2:] + self.kept},
+        )
+
+    def test_dry_run_deletes_nothing(self):
+        self.purged[0].is_used = True
+        self.purged[0].save()
+        PaymentToken.objects.filter(pk=self.purged[1].pk).update(is_paid=False)
+
+        output = self._purge(dry_run=True)
+
+        self.assertIn("Would delete 5 token(s)", output)
+        self.assertIn("1 unpaid, 3 paid and unused, 1 used", output)
+        self.assertEqual(PaymentToken.objects.count(), 7)
+
+    def test_job_results_are_removed(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        result_path = os.path.join(directory.name, 'result.zip')
+        with open(result_path, 'wb') as result_file:
+            result_file.write(b'zip')
+        GenerationJob.objects.create(
+            token=self.purged[0], inputs={}, status=GenerationJob.DONE, result_path=result_path
+        )
+        GenerationJob.objects.create(
+            token=self.purged[1], inputs={}, status=GenerationJob.DONE,
+            result_path=os.path.join(directory.name, 'missing.zip'),
+        )
+
+        self._purge()
+
+        self.assertFalse(os.path.exists(result_path))
+        self.assertFalse(GenerationJob.objects.exists())
+
+
+@override_settings(PAYROLL_RENDER_BACKEND='libreoffice', PAYROLL_CONVERTER='fake',
+                   PAYROLL_STUB_CACHE=False)
+class GenerationJobTests(TestCase):
+    """Workers claim the oldest queued job and record how it ended"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.results_dir = directory.name
+        results_dir = self.settings(PAYROLL_JOB_RESULTS_DIR=self.results_dir)
+        results_dir.enable()
+        self.addCleanup(results_dir.disable)
+        self.token = PaymentToken.objects.create(
+            stripe_session_id='session', is_paid=True, is_used=True
+        )
+
+    def _job(self, age: int = 0, **fields) -> GenerationJob:
+        fields.setdefault('inputs', dict(STUB_INPUTS))
+        job = GenerationJob.objects.create(token=self.token, **fields)
+        GenerationJob.objects.filter(pk=job.pk).update(
+            created_at=timezone.now() - timedelta(seconds=age)
+        )
+        return job
+
+    def test_claims_oldest_queued_job(self):
+        self._job(age=30, status=GenerationJob.RUNNING)
+        newer = self._job(age=10)
+        older = self._job(age=20)
+
+        claimed = [claim_next_job(), claim_next_job()]
+        self.assertEqual([job.pk for job in claimed], [older.pk, newer.pk])
+        for job in claimed:
+            job.refresh_from_db()
+            self.assertEqual(job.status, GenerationJob.RUNNING)
+            self.assertIsNotNone(job.started_at)
+        self.assertIsNone(claim_next_job())
+
+    def test_requeues_stale_jobs(self):
+        stale = self._job(status=GenerationJob.RUNNING, done=3,
+                          started_at=timezone.now() - timedelta(hours=2))
+        running = self._job(status=GenerationJob.RUNNING, started_at=timezone.now())
+
+        with self.settings(PAYROLL_JOB_STALE_AFTER=3600):
+            self.assertEqual(requeue_stale_jobs(), 1)
+        stale.refresh_from_db()
+        running.refresh_from_db()
+        self.assertEqual((stale.status, stale.done), (GenerationJob.QUEUED, 0))
+        self.assertEqual(running.status, GenerationJob.RUNNING)
+
+    def test_run_job_writes_archive(self):
+        self._job()
+        job = claim_next_job()
+        run_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, GenerationJob.DONE)
+        self.assertEqual(job.done, job.total)
+        self.assertEqual(job.result_path, os.path.join(self.results_dir, f'{job.id}.zip'))
+        with zipfile.ZipFile(job.result_path) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(len(archive.namelist()), job.total)
+        self.assertEqual(os.listdir(self.results_dir), [f'{job.id}.zip'])
+
+    def test_run_job_writes_merged_pdf(self):
+        self._job(inputs=dict(STUB_INPUTS, output='merged'))
+        job = claim_next_job()
+        run_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, GenerationJob.DONE)
+        self.assertTrue(job.result_path.endswith('.pdf'))
+        with open(job.result_path, 'rb') as result:
+            self.assertEqual(result.read(5), b'%PDF-')
+
+    def test_run_job_records_failure(self):
+        self._job(inputs=dict(STUB_INPUTS, anual='lots'))
+        job = claim_next_job()
+        run_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, GenerationJob.FAILED)
+        self.assertIn('lots', job.error)
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(job.result_path, '')
+        self.assertEqual(os.listdir(self.results_dir), [])
+
+
+class BulkValidateTests(SimpleTestCase):
+    """Every row of an upload is checked, and errors come back in row order"""
+
+    FIELDS = BulkPayrollGenerator.REQUIRED_FIELDS + ['check_id']
+
+    def _csv(self, rows) -> io.BytesIO:
+        text = io.StringIO()
+        writer = csv.DictWriter(text, fieldnames=self.FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+        return io.BytesIO(text.getvalue().encode())
+
+    def _validate(self, rows) -> list:
+        return BulkPayrollGenerator(self._csv(rows)).validate()
+
+    def test_valid_file(self):
+        self.assertEqual(self._validate([STUB_INPUTS] * 3), [])
+
+    def test_row_errors(self):
+        rows = [
+            STUB_INPUTS,
+            dict(STUB_INPUTS, end_period=STUB_INPUTS['start_period']),
+            dict(STUB_INPUTS, name='', company=''),
+            dict(STUB_INPUTS, period='15'),
+            dict(STUB_INPUTS, anual='lots'),
+            dict(STUB_INPUTS, start_period='05/01/2024'),
+        ]
+        errors = self._validate(rows)
+
+        self.assertEqual([error.split(':')[0] for error in errors],
+                         ['Row 3', 'Row 4', 'Row 5', 'Row 6', 'Row 7'])
+        self.assertEqual(errors[0], "Row 3: the date range holds no pay dates")
+        self.assertEqual(errors[1], "Row 4: missing name, company")
+        self.assertTrue(errors[2].startswith("Row 5: Unsupported pay period 15"))
+
+    def test_errors_are_capped_in_row_order(self):
+        rows = [STUB_INPUTS, dict(STUB_INPUTS, period='15')] * 30
+        with mock.patch.object(BulkPayrollGenerator, 'VALIDATE_CHUNK_ROWS', 8):
+            errors = self._validate(rows)
+
+        self.assertEqual(len(errors), BulkPayrollGenerator.MAX_ERRORS)
+        self.assertEqual([error.split(':')[0] for error in errors],
+                         [f'Row {number}' for number in range(3, 3 + 2 * len(errors), 2)])
+
+    def test_row_limit(self):
+        with self.settings(PAYROLL_BULK_MAX_ROWS=3):
+            self.assertEqual(self._validate([STUB_INPUTS] * 3), [])
+            self.assertEqual(self._validate([STUB_INPUTS] * 4), ["More than 3 employees"])
+
+    def test_empty_file(self):
+        self.assertEqual(self._validate([]), ["The file has no employees"])
+        self.assertEqual(BulkPayrollGenerator(io.BytesIO(b'')).validate(),
+                         ["The file has no employees"])
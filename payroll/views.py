@@ -3,32 +3,55 @@ Payroll PDF Generator Views
 """
 
 # Standard library imports
+import csv
 import io
-import math
 import os
-import subprocess
+import re
+import tempfile
+import uuid
 import zipfile
-from datetime import datetime, timedelta
-from typing import Dict, Tuple
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 # Third-party imports
+import numpy as np
 import stripe
+from asgiref.sync import sync_to_async
 from docx import Document
 from docx.enum.table import WD_ALIGN_VERTICAL
 from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
 from docx.shared import Pt
 from django.conf import settings
-from django.http import HttpRequest, HttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import (
+    FileResponse, Http404, HttpRequest, HttpResponse, JsonResponse, StreamingHttpResponse
+)
 from django.shortcuts import get_object_or_404, redirect, render
-from django.utils import timezone
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 
 # Local application imports
-from .models import PaymentToken
+from .admission import get_admission_controller
+from .converters import get_converter
+from .docx_templates import CompiledTemplate, merge_documents, template_cache
+from .formatting import decimal_part, format_cents_many, number_to_words
+from .layout import StubLayout
+from .metrics import increment, render_prometheus, span, timed
+from .models import GenerationJob, PaymentToken
+from .money import Money
+from .parallel import iter_ordered, run_ordered
+from .pdf import PdfDocument
+from .schedule import PaySchedule, check_frequency
+from .stub_cache import get_stub_cache
+from .webhooks import receive_event
 
 # Stripe configuration
 stripe.api_key = settings.STRIPE_SECRET_KEY
+if settings.STRIPE_API_BASE:
+    # e.g. a local stub of the Stripe API in development and tests
+    stripe.api_base = settings.STRIPE_API_BASE
 
 
 
@@ -43,37 +66,32 @@ TAX_BRACKETS = [
     (539901, float('inf'), 0.37)
 ]
 
+# Rates are applied exactly as integers in units of 1/RATE_SCALE
+RATE_SCALE = 10_000
+
+BRACKET_LOWER = np.array([lower for lower, _, _ in TAX_BRACKETS], dtype=np.float64)
+BRACKET_UPPER = np.array([upper for _, upper, _ in TAX_BRACKETS], dtype=np.float64)
+BRACKET_RATES = np.array([round(rate * RATE_SCALE) for _, _, rate in TAX_BRACKETS], dtype=np.int64)
+
 SOCIAL_SECURITY_RATE = 0.062
 MEDICARE_RATE = 0.0145
 
-START_DATE = datetime(2023, 12, 21)
-PAY_DATE_REFERENCE = datetime(2023, 12, 22)
-BIWEEKLY_DAYS = 14
-WEEKLY_DAYS = 7
+TEMPLATE_PATH = 'base.docx'
 
-NUMBER_WORDS = {
-    0: "ZERO", 1: "ONE", 2: "TWO", 3: "THREE", 4: "FOUR", 5: "FIVE",
-    6: "SIX", 7: "SEVEN", 8: "EIGHT", 9: "NINE", 10: "TEN",
-    11: "ELEVEN", 12: "TWELVE", 13: "THIRTEEN", 14: "FOURTEEN", 15: "FIFTEEN",
-    16: "SIXTEEN", 17: "SEVENTEEN", 18: "EIGHTEEN", 19: "NINETEEN",
-    20: "TWENTY", 30: "THIRTY", 40: "FORTY", 50: "FIFTY",
-    60: "SIXTY", 70: "SEVENTY", 80: "EIGHTY", 90: "NINETY"
-}
-
-HUNDREDS_WORDS = {
-    100: "HUNDRED",
-    1000: "THOUSAND"
-}
+# Anything but letters, digits, spaces, dots and dashes is replaced in file names
+UNSAFE_FILE_CHARS = re.compile(r'[^\w .-]')
 
 
 class PayrollCalculator:
     """Calculate payroll deductions and taxes"""
     
     @staticmethod
-    def calculate(annual_salary: int, pay_period: int) -> Tuple[float, float, float, float, float]:
+    def calculate(annual_salary: int, pay_period: int) -> Tuple[Money, Money, Money, Money, Money]:
         """
         Calculate payroll values
         
+        Every value is rounded up to the cent, exactly.
+        
         Args:
             annual_salary: Annual salary amount
             pay_period: Number of pay periods per year
@@ -81,16 +99,55 @@ class PayrollCalculator:
         Returns:
             Tuple of (gross_salary, fed_withholding, ss, medicare, fica_deduction)
         """
-        gross_salary = PayrollCalculator._round_up(annual_salary / pay_period)
-        fed_withholding = PayrollCalculator._round_up(
-            gross_salary * PayrollCalculator._get_tax_rate(annual_salary)
+        gross_salary = Money.from_amount(annual_salary).divide_up(pay_period)
+        fed_withholding = gross_salary.times_rate_up(PayrollCalculator._get_tax_rate(annual_salary))
+        ss = gross_salary.times_rate_up(SOCIAL_SECURITY_RATE)
+        medicare = gross_salary.times_rate_up(MEDICARE_RATE)
+        fica_deduction = fed_withholding + ss + medicare
+        
+        return gross_salary, fed_withholding, ss, medicare, fica_deduction
+    
+    @staticmethod
+    def calculate_batch(annual_salaries, pay_periods) -> Tuple[np.ndarray, ...]:
+        """
+        Calculate payroll values for many salaries at once
+        
+        Args:
+            annual_salaries: Array-like of annual salary amounts
+            pay_periods: Array-like of pay periods per year, or a single value
+            
+        Returns:
+            Tuple of integer cent arrays (gross_salary, fed_withholding, ss,
+            medicare, fica_deduction), element for element equal to the
+            cents of calculate()
+        """
+        annual_salaries = np.asarray(annual_salaries, dtype=np.float64)
+        pay_periods = np.asarray(pay_periods, dtype=np.int64)
+        
+        def times_rate_up(cents: np.ndarray, scaled_rate) -> np.ndarray:
+            return -(-cents * scaled_rate // RATE_SCALE)
+        
+        annual_cents = np.rint(annual_salaries * 100).astype(np.int64)
+        gross_salary = -(-annual_cents // pay_periods)
+        fed_withholding = times_rate_up(
+            gross_salary, PayrollCalculator._get_tax_rates(annual_salaries)
         )
-        ss = PayrollCalculator._round_up(gross_salary * SOCIAL_SECURITY_RATE)
-        medicare = PayrollCalculator._round_up(gross_salary * MEDICARE_RATE)
-        fica_deduction = PayrollCalculator._round_up(fed_withholding + ss + medicare)
+        ss = times_rate_up(gross_salary, round(SOCIAL_SECURITY_RATE * RATE_SCALE))
+        medicare = times_rate_up(gross_salary, round(MEDICARE_RATE * RATE_SCALE))
+        fica_deduction = fed_withholding + ss + medicare
         
         return gross_salary, fed_withholding, ss, medicare, fica_deduction
     
+    @staticmethod
+    def _get_tax_rates(incomes: np.ndarray) -> np.ndarray:
+        """Vectorized _get_tax_rate, in units of 1/RATE_SCALE"""
+        index = np.searchsorted(BRACKET_LOWER, incomes, side='right') - 1
+        clipped = np.clip(index, 0, len(TAX_BRACKETS) - 1)
+        # Incomes below the first bracket or between two brackets get the
+        # highest rate, as in the linear scan
+        in_bracket = (index >= 0) & (incomes <= BRACKET_UPPER[clipped])
+        return np.where(in_bracket, BRACKET_RATES[clipped], BRACKET_RATES[-1])
+    
     @staticmethod
     def _get_tax_rate(income: float) -> float:
         """Get applicable tax rate based on income"""
@@ -98,151 +155,305 @@ class PayrollCalculator:
             if lower <= income <= upper:
                 return rate
         return TAX_BRACKETS[-1][2]  # Return highest bracket if not found
-    
-    @staticmethod
-    def _round_up(number: float, decimals: int = 2) -> float:
-        """Round up to specified decimal places"""
-        factor = 10 ** decimals
-        return math.ceil(number * factor) / factor
 
 
-class NumberFormatter:
-    """Format numbers for display"""
+class PayrollDocumentGenerator:
+    """Generate payroll documents"""
     
-    @staticmethod
-    def format_currency(number: float) -> str:
-        """Format number as currency with commas and 2 decimals"""
-        return "{:,.2f}".format(number)
+    def __init__(self, request_data: Dict, payroll_data: Tuple):
+        self.request_data = request_data
+        self.gross_salary, self.fed_withholding, self.ss, self.medicare, self.fica_deduction = payroll_data
+        self.net_pay = self.gross_salary - self.fica_deduction
+        self.amounts = self._format_amounts()
+        self.scratch_dir = None
+        self.schedule = None
+        self.periods = None
+        self.ytd = {}
+        
+    def generate_multiple_pdfs(self) -> HttpResponse:
+        """Generate multiple payroll PDFs and return as ZIP"""
+        periods = self.get_periods()
+        
+        if self.wants_merged(self.request_data):
+            return self._create_merged_response(periods)
+        
+        if settings.PAYROLL_STREAM_ZIP:
+            return self.create_streaming_zip_response(self._iter_pdfs(periods))
+        
+        # Files the converter needs live in a private per-request directory
+        with tempfile.TemporaryDirectory(prefix='payroll-',
+                                         dir=settings.PAYROLL_SCRATCH_DIR) as scratch_dir:
+            self.scratch_dir = scratch_dir
+            pdfs = self._render_pdfs(periods)
+        
+        return self._create_zip_response(pdfs)
     
-    @staticmethod
-    def get_decimal_part(number: float) -> str:
-        """Extract decimal part of a number as string"""
-        number_str = str(number)
-        parts = number_str.split('.')
-        if len(parts) > 1:
-            return parts[1][:2].ljust(2, '0')
-        return "00"
+    def write_archive(self, file_obj, progress: Optional[Callable[[int, int], None]] = None):
+        """
+        Generate every PDF and write the ZIP archive to a file object
+        
+        Args:
+            file_obj: Writable binary file for the archive
+            progress: Called with (stubs done, total stubs) after each stub
+        """
+        periods = self.get_periods()
+        with self._open_zip(file_obj) as zip_file:
+            for done, (pdf_name, pdf_data) in enumerate(self._iter_pdfs(periods), 1):
+                zip_file.writestr(pdf_name, pdf_data)
+                if progress:
+                    progress(done, len(periods))
+    
+    def write_merged_pdf(self, file_obj, progress: Optional[Callable[[int, int], None]] = None):
+        """
+        Generate every period as pages of one PDF and write it to a file object
+        
+        Args:
+            file_obj: Writable binary file for the PDF
+            progress: Called with (stubs done, total stubs) once the PDF is written
+        """
+        periods = self.get_periods()
+        file_obj.write(self._render_merged(periods))
+        if progress:
+            progress(len(periods), len(periods))
     
     @staticmethod
-    def number_to_words(num: int) -> str:
-        """Convert number to words in English (0-9999)"""
-        if num < 20:
-            return NUMBER_WORDS[num]
-        elif num < 100:
-            tens = num // 10 * 10
-            ones = num % 10
-            if ones == 0:
-                return NUMBER_WORDS[tens]
-            return f"{NUMBER_WORDS[tens]} {NUMBER_WORDS[ones]}"
-        elif num < 1000:
-            hundreds = num // 100
-            remainder = num % 100
-            if remainder == 0:
-                return f"{NUMBER_WORDS[hundreds]} {HUNDREDS_WORDS[100]}"
-            return f"{NUMBER_WORDS[hundreds]} {HUNDREDS_WORDS[100]} AND {NumberFormatter.number_to_words(remainder)}"
-        elif num < 10000:
-            thousands = num // 1000
-            remainder = num % 1000
-            if remainder == 0:
-                return f"{NUMBER_WORDS[thousands]} {HUNDREDS_WORDS[1000]}"
-            return f"{NUMBER_WORDS[thousands]} {HUNDREDS_WORDS[1000]} {NumberFormatter.number_to_words(remainder)}"
-        return "Number out of range (must be between 0 and 9999)"
-
-
-class PayDateCalculator:
-    """Calculate and validate pay dates"""
+    def wants_merged(request_data: Dict) -> bool:
+        """Whether the request asked for a single PDF instead of a ZIP"""
+        return request_data.get('output', settings.PAYROLL_OUTPUT) == 'merged'
     
     @staticmethod
-    def get_correct_pay_date(pay_date: datetime) -> datetime:
+    def get_merged_name(request_data: Dict) -> str:
+        """File name of the single PDF holding every period"""
+        return f"{PayrollDocumentGenerator.get_employee_name(request_data)}_payroll.pdf"
+    
+    @timed('schedule')
+    def get_periods(self) -> List[Tuple[int, datetime, int]]:
         """
-        Adjust pay date to fall on a valid biweekly schedule
+        Get the (index, pay date, payment number) of every stub to generate
         
-        Args:
-            pay_date: The requested pay date
-            
-        Returns:
-            Adjusted pay date that falls on the biweekly schedule
+        The schedule and the year-to-date totals of every stub are computed
+        here once, in a single pass over the pay dates, and reused by later
+        calls.
         """
-        if (pay_date - datetime(2024, 1, 5)).days % BIWEEKLY_DAYS == 0:
-            return pay_date
-        
-        rounded = (pay_date - PAY_DATE_REFERENCE).days // BIWEEKLY_DAYS
-        mult = rounded * BIWEEKLY_DAYS
-        return PAY_DATE_REFERENCE + timedelta(days=mult)
-
-
-class PayrollDocumentGenerator:
-    """Generate payroll documents"""
-    
-    def __init__(self, request_data: Dict, payroll_data: Tuple):
-        self.request_data = request_data
-        self.gross_salary, self.fed_withholding, self.ss, self.medicare, self.fica_deduction = payroll_data
-        self.output_dir = os.path.join('media', 'pdfs')
+        if self.periods is not None:
+            return self.periods
         
-    def generate_multiple_pdfs(self) -> HttpResponse:
-        """Generate multiple payroll PDFs and return as ZIP"""
-        start_period = PayDateCalculator.get_correct_pay_date(
-            datetime.strptime(self.request_data['start_period'], '%Y-%m-%d')
-        )
-        end_period = PayDateCalculator.get_correct_pay_date(
-            datetime.strptime(self.request_data['end_period'], '%Y-%m-%d')
+        self.schedule = PaySchedule.build(
+            datetime.strptime(self.request_data['start_period'], '%Y-%m-%d'),
+            datetime.strptime(self.request_data['end_period'], '%Y-%m-%d'),
+            int(self.request_data['period']),
+            max_periods=settings.PAYROLL_MAX_PERIODS
         )
-        number_payments = (end_period - start_period).days // BIWEEKLY_DAYS
-        period = int(self.request_data['period'])
         
-        temp_files = []
-        final_pdf_paths = []
+        totals = self.schedule.ytd_totals([
+            amount.cents for amount in (
+                self.gross_salary, self.fed_withholding, self.ss, self.medicare, self.fica_deduction
+            )
+        ])
+        # Format each year-to-date column in one go
+        columns = [format_cents_many(column) for column in zip(*totals)]
+        self.ytd = dict(zip(self.schedule.dates, zip(*columns)))
         
-        try:
-            self._ensure_output_dir()
-            
-            for i in range(number_payments):
-                start_period += timedelta(days=BIWEEKLY_DAYS)
-                payment_number = self._calculate_payment_number(start_period, period)
-                
-                temp_docx, final_pdf = self._generate_single_pdf(
-                    i, start_period, payment_number
-                )
-                temp_files.append(temp_docx)
-                final_pdf_paths.append(final_pdf)
-            
-            return self._create_zip_response(final_pdf_paths)
+        self.periods = [
+            (i, pay_date, payment_number)
+            for i, (pay_date, payment_number) in enumerate(
+                zip(self.schedule.dates, self.schedule.numbers)
+            )
+        ]
+        return self.periods
+    
+    def _iter_pdfs(self, periods: List[Tuple[int, datetime, int]]) -> Iterator[Tuple[str, bytes]]:
+        """
+        Yield (file name, PDF bytes) pairs in order as each period finishes
+        
+        Every period is converted on its own so the first stub is ready
+        after one conversion; batch conversion does not apply here.
+        """
+        with tempfile.TemporaryDirectory(prefix='payroll-',
+                                         dir=settings.PAYROLL_SCRATCH_DIR) as scratch_dir:
+            self.scratch_dir = scratch_dir
             
-        finally:
-            self._cleanup_files(temp_files + final_pdf_paths)
+            results = iter_ordered(self._generate_stub, periods)
+            for (_, start, _), pdf_data in zip(periods, results):
+                yield self._get_pdf_name(start), pdf_data
     
-    def _ensure_output_dir(self):
-        """Create output directory if it doesn't exist"""
-        if not os.path.exists(self.output_dir):
-            os.makedirs(self.output_dir)
+    def _generate_stub(self, index: int, start_period: datetime, payment_number: int) -> bytes:
+        """Return the PDF bytes of one period, from the stub cache when possible"""
+        cache = get_stub_cache()
+        if cache:
+            cache_key = self._get_cache_key(start_period, payment_number)
+            pdf_data = cache.get(cache_key)
+            increment('payroll_stub_cache_total', result='miss' if pdf_data is None else 'hit')
+            if pdf_data is not None:
+                return pdf_data
+        
+        if settings.PAYROLL_RENDER_BACKEND == 'native':
+            pdf_data = self._generate_native_pdf(index, start_period, payment_number)
+        else:
+            pdf_path = self._generate_single_pdf(index, start_period, payment_number)
+            with open(pdf_path, 'rb') as pdf_file:
+                pdf_data = pdf_file.read()
+            os.remove(pdf_path)
+        
+        if cache:
+            cache.put(cache_key, pdf_data)
+        return pdf_data
     
-    def _calculate_payment_number(self, start_period: datetime, period: int) -> int:
-        """Calculate the payment number based on period"""
-        days_divisor = BIWEEKLY_DAYS if period == 26 else WEEKLY_DAYS
-        return (start_period - START_DATE).days // days_divisor
+    def _render_pdfs(self, periods: List[Tuple[int, datetime, int]]) -> List[Tuple[str, bytes]]:
+        """Render every period and return (file name, PDF bytes) pairs in order"""
+        cache = get_stub_cache()
+        if cache:
+            cache_keys = [self._get_cache_key(start, number) for _, start, number in periods]
+            cached = [cache.get(cache_key) for cache_key in cache_keys]
+            hits = sum(pdf_data is not None for pdf_data in cached)
+            increment('payroll_stub_cache_total', hits, result='hit')
+            increment('payroll_stub_cache_total', len(cached) - hits, result='miss')
+        else:
+            cached = [None] * len(periods)
+        
+        # Only the periods missing from the cache are rendered
+        missing = [period for period, pdf_data in zip(periods, cached) if pdf_data is None]
+        rendered = iter(self._render_uncached(missing))
+        
+        pdfs = []
+        for i, ((_, start, _), pdf_data) in enumerate(zip(periods, cached)):
+            if pdf_data is None:
+                pdf_data = next(rendered)
+                if cache:
+                    cache.put(cache_keys[i], pdf_data)
+            pdfs.append((self._get_pdf_name(start), pdf_data))
+        return pdfs
+    
+    def _render_uncached(self, periods: List[Tuple[int, datetime, int]]) -> List[bytes]:
+        """Render the PDF bytes of every period in order"""
+        if settings.PAYROLL_RENDER_BACKEND == 'native':
+            return run_ordered(self._generate_native_pdf, periods)
+        
+        if settings.PAYROLL_BATCH_CONVERSION:
+            # Render every DOCX first and convert them together
+            docx_paths = run_ordered(self._generate_single_docx, periods)
+            pdf_paths = [self._get_pdf_path(start) for _, start, _ in periods]
+            with span('convert'):
+                get_converter().convert_many(list(zip(docx_paths, pdf_paths)))
+        else:
+            pdf_paths = run_ordered(self._generate_single_pdf, periods)
+        
+        pdfs = []
+        for pdf_path in pdf_paths:
+            with open(pdf_path, 'rb') as pdf_file:
+                pdfs.append(pdf_file.read())
+        return pdfs
+    
+    def _get_cache_key(self, start_period: datetime, payment_number: int) -> str:
+        """Stub cache key of one period"""
+        backend = settings.PAYROLL_RENDER_BACKEND
+        if backend != 'native':
+            # The converter decides what the DOCX turns into
+            backend = f'{backend}:{settings.PAYROLL_CONVERTER}'
+        return get_stub_cache().key(
+            self._get_replacements(start_period, payment_number), TEMPLATE_PATH, backend
+        )
     
     def _generate_single_pdf(self, index: int, start_period: datetime, 
-                            payment_number: int) -> Tuple[str, str]:
+                            payment_number: int) -> str:
         """Generate a single payroll PDF"""
-        temp_docx_path = f'temp_modified_{index}.docx'
+        temp_docx_path = self._generate_single_docx(index, start_period, payment_number)
+        
+        # Convert to PDF
+        return self._convert_to_pdf(temp_docx_path, index, start_period)
+    
+    def _generate_single_docx(self, index: int, start_period: datetime,
+                              payment_number: int) -> str:
+        """Generate a single filled-in payroll DOCX"""
+        temp_docx_path = self._get_temp_docx_path(index)
         
         # Create and modify document
-        doc = Document('base.docx')
         replacements = self._get_replacements(start_period, payment_number)
-        self._apply_replacements(doc, replacements)
+        with span('fill'):
+            doc = self._get_compiled_template(replacements).fill(replacements)
         
         # Save temporary docx
-        doc.save(temp_docx_path)
+        with span('save'):
+            doc.save(temp_docx_path)
         
-        # Convert to PDF
-        final_pdf_path = self._convert_to_pdf(temp_docx_path, index, start_period)
+        return temp_docx_path
+    
+    def _generate_native_pdf(self, index: int, start_period: datetime,
+                             payment_number: int) -> bytes:
+        """Draw a single payroll PDF in-process, without DOCX or LibreOffice"""
+        return self._generate_native_document(index, start_period, payment_number).to_bytes()
+    
+    @timed('render_native')
+    def _generate_native_document(self, index: int, start_period: datetime,
+                                  payment_number: int) -> PdfDocument:
+        """Draw the pages of a single stub"""
+        replacements = self._get_replacements(start_period, payment_number)
+        layout = StubLayout.load(
+            TEMPLATE_PATH,
+            # Compile the template with the same cell formatting the DOCX path applies
+            prepare=lambda doc: self._apply_replacements(doc, {key: key for key in replacements})
+        )
+        return layout.render(replacements)
+    
+    def _render_merged_pdf(self, periods: List[Tuple[int, datetime, int]]) -> bytes:
+        """
+        Render every period as consecutive pages of a single PDF
+        
+        The native backend draws the stubs in parallel and joins their pages
+        into one document that carries one copy of the fonts. LibreOffice
+        gets the filled DOCX bodies joined with page breaks and converts
+        them once.
+        """
+        if settings.PAYROLL_RENDER_BACKEND == 'native':
+            merged = PdfDocument()
+            for document in run_ordered(self._generate_native_document, periods):
+                merged.extend(document)
+            return merged.to_bytes()
+        
+        docs = []
+        for _, start_period, payment_number in periods:
+            replacements = self._get_replacements(start_period, payment_number)
+            with span('fill'):
+                docs.append(self._get_compiled_template(replacements).fill(replacements))
         
-        return temp_docx_path, final_pdf_path
+        docx_path = os.path.join(self.scratch_dir, 'merged.docx')
+        pdf_path = os.path.join(self.scratch_dir, 'merged.pdf')
+        with span('merge'):
+            merge_documents(docs).save(docx_path)
+        with span('convert'):
+            get_converter().convert(docx_path, pdf_path)
+        
+        with open(pdf_path, 'rb') as pdf_file:
+            return pdf_file.read()
+    
+    def _get_temp_docx_path(self, index: int) -> str:
+        """Get the temporary DOCX path for a pay period"""
+        return os.path.join(self.scratch_dir, f'temp_modified_{index}.docx')
+    
+    def _get_pdf_name(self, start_period: datetime) -> str:
+        """Get the PDF file name for a pay period"""
+        return f"{self.get_employee_name(self.request_data)}_{start_period.strftime('%m%d%Y')}.pdf"
+    
+    @staticmethod
+    def get_employee_name(request_data: Dict) -> str:
+        """
+        The employee's name as it may appear in a file name
+        
+        Path separators and other unsafe characters become underscores and
+        leading dots are dropped, so the name can neither leave the scratch
+        directory nor escape its folder in an archive.
+        """
+        name = UNSAFE_FILE_CHARS.sub('_', f"{request_data['name']}{request_data['last_name']}")
+        return name.lstrip('. ') or 'employee'
+    
+    def _get_pdf_path(self, start_period: datetime) -> str:
+        """Get the scratch PDF path for a pay period"""
+        return os.path.join(self.scratch_dir, self._get_pdf_name(start_period))
     
     def _get_replacements(self, start_period: datetime, payment_number: int) -> Dict[str, str]:
         """Get dictionary of placeholder replacements"""
-        net_pay = self.gross_salary - self.fica_deduction
         check_id = self.request_data.get('check_id', '')
+        salary_ytd, fed_ytd, ss_ytd, medicare_ytd, taxes_ytd = self.ytd[start_period]
         
         return {
             '<<nombre>>': f"{self.request_data['name']} {self.request_data['last_name']}",
@@ -252,39 +463,56 @@ class PayrollDocumentGenerator:
             '<<address_co>>': self.request_data['address_co'],
             '<<check_id>>': str(check_id),
             '<<fecha>>': start_period.strftime('%m/%d/%Y'),
-            '<<pay_date>>': (start_period - timedelta(days=BIWEEKLY_DAYS)).strftime('%m/%d/%Y'),
-            '<<netpaytext>>': NumberFormatter.number_to_words(round(net_pay)),
-            '<<decimal>>': NumberFormatter.get_decimal_part(net_pay),
+            '<<pay_date>>': self.schedule.previous(start_period).strftime('%m/%d/%Y'),
+            '<<netpaytext>>': self.amounts['netpaytext'],
+            '<<decimal>>': self.amounts['decimal'],
             '<<ssn_digits>>': self.request_data['ssn_digits'],
-            '<<netpay>>': NumberFormatter.format_currency(PayrollCalculator._round_up(net_pay)),
+            '<<netpay>>': self.amounts['netpay'],
             '<<dependents>>': self.request_data['dependents'],
-            '<<salary>>': NumberFormatter.format_currency(self.gross_salary),
-            '<<fed>>': NumberFormatter.format_currency(self.fed_withholding),
-            '<<ss>>': NumberFormatter.format_currency(self.ss),
-            '<<mc>>': NumberFormatter.format_currency(self.medicare),
-            '<<totalt>>': NumberFormatter.format_currency(
-                PayrollCalculator._round_up(self.fed_withholding + self.ss + self.medicare)
-            ),
+            '<<salary>>': self.amounts['salary'],
+            '<<fed>>': self.amounts['fed'],
+            '<<ss>>': self.amounts['ss'],
+            '<<mc>>': self.amounts['mc'],
+            '<<totalt>>': self.amounts['totalt'],
             # Year to Date
-            '<<salaryytd>>': NumberFormatter.format_currency(
-                PayrollCalculator._round_up(self.gross_salary * payment_number)
-            ),
-            '<<fedytd>>': NumberFormatter.format_currency(
-                PayrollCalculator._round_up(self.fed_withholding * payment_number)
-            ),
-            '<<ssytd>>': NumberFormatter.format_currency(
-                PayrollCalculator._round_up(self.ss * payment_number)
-            ),
-            '<<mcytd>>': NumberFormatter.format_currency(
-                PayrollCalculator._round_up(self.medicare * payment_number)
-            ),
-            '<<totaltytd>>': NumberFormatter.format_currency(
-                PayrollCalculator._round_up(
-                    (self.fed_withholding + self.ss + self.medicare) * payment_number
-                )
-            ),
+            '<<salaryytd>>': salary_ytd,
+            '<<fedytd>>': fed_ytd,
+            '<<ssytd>>': ss_ytd,
+            '<<mcytd>>': medicare_ytd,
+            '<<totaltytd>>': taxes_ytd,
         }
     
+    def _format_amounts(self) -> Dict[str, str]:
+        """Format the per-period amounts, which are the same on every stub"""
+        salary, fed, ss, medicare, taxes, net_pay = format_cents_many([
+            amount.cents for amount in (
+                self.gross_salary, self.fed_withholding, self.ss, self.medicare,
+                self.fica_deduction, self.net_pay
+            )
+        ])
+        return {
+            # The words carry the whole dollars and <<decimal>> the cents
+            'netpaytext': number_to_words(self.net_pay.cents // 100),
+            'decimal': decimal_part(self.net_pay.cents),
+            'netpay': net_pay,
+            'salary': salary,
+            'fed': fed,
+            'ss': ss,
+            'mc': medicare,
+            'totalt': taxes,
+        }
+    
+    def _get_compiled_template(self, replacements: Dict[str, str]) -> CompiledTemplate:
+        """Get the template with stub formatting applied and placeholders indexed"""
+        keys = tuple(replacements)
+        return template_cache.compiled(
+            TEMPLATE_PATH,
+            # Replacing every key with itself collapses the placeholder runs
+            # and applies the cell formatting once, at template load
+            prepare=lambda doc: self._apply_replacements(doc, {key: key for key in keys}),
+            variant=keys
+        )
+    
     def _apply_replacements(self, doc: Document, replacements: Dict[str, str]):
         """Apply text replacements and formatting to document"""
         no_font_size_changes = {'<<nombre>>', '<<fecha>>', '<<netpay>>', 
@@ -321,95 +549,290 @@ class PayrollDocumentGenerator:
     
     def _convert_to_pdf(self, docx_path: str, index: int, 
                        start_period: datetime) -> str:
-        """Convert DOCX to PDF using LibreOffice"""
-        result = subprocess.run(
-            ['libreoffice', '--headless', '--convert-to', 'pdf', 
-             '--outdir', self.output_dir, docx_path],
-            capture_output=True,
-            text=True
-        )
-        
-        if result.returncode != 0:
-            raise RuntimeError(f"PDF conversion failed: {result.stderr}")
-        
-        temp_pdf_path = os.path.join(self.output_dir, f'temp_modified_{index}.pdf')
-        if not os.path.exists(temp_pdf_path):
-            raise FileNotFoundError(f"PDF not created: {temp_pdf_path}")
-        
-        # Rename to final name
-        pdf_name = (f"{self.request_data['name']}{self.request_data['last_name']}_"
-                   f"{start_period.strftime('%m%d%Y')}.pdf")
-        final_pdf_path = os.path.join(self.output_dir, pdf_name)
-        os.rename(temp_pdf_path, final_pdf_path)
+        """Convert DOCX to PDF using the configured LibreOffice converter"""
+        final_pdf_path = self._get_pdf_path(start_period)
+        with span('convert'):
+            get_converter().convert(docx_path, final_pdf_path)
         
         return final_pdf_path
     
-    def _create_zip_response(self, pdf_paths: list) -> HttpResponse:
+    @timed('zip')
+    def _create_zip_response(self, pdfs: List[Tuple[str, bytes]]) -> HttpResponse:
         """Create ZIP file response with all PDFs"""
         zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w') as zip_file:
-            for pdf_path in pdf_paths:
-                zip_file.write(pdf_path, os.path.basename(pdf_path))
+        with self._open_zip(zip_buffer) as zip_file:
+            for pdf_name, pdf_data in pdfs:
+                zip_file.writestr(pdf_name, pdf_data)
         
         zip_buffer.seek(0)
         response = HttpResponse(zip_buffer, content_type='application/zip')
         response['Content-Disposition'] = 'attachment; filename="payroll_pdfs.zip"'
         return response
     
+    def _create_merged_response(self, periods: List[Tuple[int, datetime, int]]) -> HttpResponse:
+        """Create a response holding every period in one PDF"""
+        response = HttpResponse(self._render_merged(periods), content_type='application/pdf')
+        response['Content-Disposition'] = (
+            f'attachment; filename="{self.get_merged_name(self.request_data)}"'
+        )
+        return response
+    
+    def _render_merged(self, periods: List[Tuple[int, datetime, int]]) -> bytes:
+        """Render the single PDF in a private scratch directory"""
+        if not periods:
+            raise ValueError("The date range holds no pay dates")
+        
+        with tempfile.TemporaryDirectory(prefix='payroll-',
+                                         dir=settings.PAYROLL_SCRATCH_DIR) as scratch_dir:
+            self.scratch_dir = scratch_dir
+            return self._render_merged_pdf(periods)
+    
     @staticmethod
-    def _cleanup_files(file_paths: list):
-        """Remove temporary files"""
-        for path in file_paths:
-            if os.path.exists(path):
+    def create_streaming_zip_response(pdfs: Iterable[Tuple[str, bytes]],
+                                      filename: str = 'payroll_pdfs.zip') -> StreamingHttpResponse:
+        """Create a ZIP response that sends each PDF as soon as it is ready"""
+        def stream():
+            sink = _ZipStream()
+            # An unseekable sink makes zipfile write data descriptors, so no
+            # entry has to be revisited once its bytes are sent
+            with PayrollDocumentGenerator._open_zip(sink) as zip_file:
+                for pdf_name, pdf_data in pdfs:
+                    zip_file.writestr(pdf_name, pdf_data)
+                    yield sink.drain()
+            yield sink.drain()
+        
+        response = StreamingHttpResponse(stream(), content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+    
+    @staticmethod
+    def _open_zip(file_obj) -> zipfile.ZipFile:
+        """Open a ZIP archive for writing with the configured compression"""
+        if settings.PAYROLL_ZIP_COMPRESSION == 'deflated':
+            return zipfile.ZipFile(file_obj, 'w', compression=zipfile.ZIP_DEFLATED,
+                                   compresslevel=settings.PAYROLL_ZIP_COMPRESSLEVEL)
+        return zipfile.ZipFile(file_obj, 'w', compression=zipfile.ZIP_STORED)
+
+
+class _ZipStream:
+    """Write-only file object that collects what zipfile writes until drained"""
+    
+    def __init__(self):
+        self._chunks = []
+    
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def drain(self) -> bytes:
+        """Return and forget everything written so far"""
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class BulkPayrollGenerator:
+    """Generate the stubs of every employee listed in a CSV file"""
+    
+    REQUIRED_FIELDS = [
+        'name', 'last_name', 'client_address', 'city_state', 'company', 'address_co',
+        'ssn_digits', 'dependents', 'anual', 'period', 'start_period', 'end_period',
+    ]
+    MAX_ERRORS = 20
+    # Rows priced together by calculate_batch while validating
+    VALIDATE_CHUNK_ROWS = 256
+    
+    def __init__(self, csv_file):
+        self.csv_file = csv_file
+    
+    def validate(self) -> List[str]:
+        """
+        Check every row without keeping any of them in memory
+        
+        Rows are read VALIDATE_CHUNK_ROWS at a time and each chunk is
+        priced with one calculate_batch call.
+        
+        Returns:
+            Error messages, at most MAX_ERRORS of them; empty when the file is valid
+        """
+        errors = []
+        rows = 0
+        chunk = []
+        for row_number, row in self._rows():
+            rows += 1
+            if rows > settings.PAYROLL_BULK_MAX_ROWS:
+                break
+            chunk.append((row_number, row))
+            if len(chunk) == self.VALIDATE_CHUNK_ROWS:
+                errors.extend(self._validate_chunk(chunk))
+                chunk = []
+                if len(errors) >= self.MAX_ERRORS:
+                    break
+        if chunk:
+            errors.extend(self._validate_chunk(chunk))
+        
+        errors = errors[:self.MAX_ERRORS]
+        if rows > settings.PAYROLL_BULK_MAX_ROWS:
+            errors.append(f"More than {settings.PAYROLL_BULK_MAX_ROWS} employees")
+        if rows == 0 and not errors:
+            errors.append("The file has no employees")
+        return errors
+    
+    def iter_pdfs(self) -> Iterator[Tuple[str, bytes]]:
+        """
+        Yield (archive path, PDF bytes) pairs, one folder per employee
+        
+        The periods of every row go through one iter_ordered stream, so
+        a file of one-period rows is rendered in parallel too.
+        """
+        with tempfile.TemporaryDirectory(prefix='payroll-bulk-',
+                                         dir=settings.PAYROLL_SCRATCH_DIR) as scratch_dir:
+            yield from iter_ordered(self._generate_row_stub, self._stub_tasks(scratch_dir))
+    
+    def _stub_tasks(self, scratch_dir: str) -> Iterator[Tuple]:
+        """Arguments of _generate_row_stub for every period of every row, in order"""
+        for row_number, row in self._rows():
+            generator = self.generator_for(row)
+            # Rows can share a name, so each keeps its files apart
+            generator.scratch_dir = os.path.join(scratch_dir, f'{row_number:05d}')
+            os.mkdir(generator.scratch_dir)
+            folder = f"{row_number:05d}_{PayrollDocumentGenerator.get_employee_name(row)}"
+            for period in generator.get_periods():
+                yield (generator, folder) + period
+    
+    @staticmethod
+    def _generate_row_stub(generator: PayrollDocumentGenerator, folder: str, index: int,
+                           start_period: datetime, payment_number: int) -> Tuple[str, bytes]:
+        """Render one period of one row as its (archive path, PDF bytes) pair"""
+        pdf_data = generator._generate_stub(index, start_period, payment_number)
+        return f'{folder}/{generator._get_pdf_name(start_period)}', pdf_data
+    
+    def _rows(self) -> Iterator[Tuple[int, Dict[str, str]]]:
+        """Read the CSV from the start, yielding (row number, row) pairs"""
+        self.csv_file.seek(0)
+        text_file = io.TextIOWrapper(self.csv_file, encoding='utf-8-sig', newline='')
+        reader = csv.DictReader(text_file)
+        try:
+            for row in reader:
+                yield reader.line_num, {
+                    key.strip(): (value or '').strip()
+                    for key, value in row.items() if key is not None
+                }
+        finally:
+            # Leave the upload open for the next pass
+            text_file.detach()
+    
+    @classmethod
+    def _validate_chunk(cls, chunk: List[Tuple[int, Dict[str, str]]]) -> List[str]:
+        """Error messages of a chunk of (row number, row) pairs, in row order"""
+        errors = {}
+        priced = []
+        for row_number, row in chunk:
+            try:
+                priced.append((row_number, row) + cls._check_row(row))
+            except ValueError as e:
+                errors[row_number] = str(e)
+        
+        if priced:
+            columns = PayrollCalculator.calculate_batch(
+                [annual_salary for _, _, annual_salary, _ in priced],
+                [pay_period for _, _, _, pay_period in priced]
+            )
+            for i, (row_number, row, _, _) in enumerate(priced):
+                payroll_data = tuple(Money(int(column[i])) for column in columns)
                 try:
-                    os.remove(path)
-                except OSError:
-                    pass  # Ignore cleanup errors
+                    cls.generator_for(row, payroll_data=payroll_data)
+                except ValueError as e:
+                    errors[row_number] = str(e)
+        
+        return [f"Row {row_number}: {errors[row_number]}" for row_number in sorted(errors)]
+    
+    @classmethod
+    def generator_for(cls, row: Dict[str, str], allow_blank: bool = False,
+                      payroll_data: Optional[Tuple[Money, ...]] = None) -> PayrollDocumentGenerator:
+        """
+        Check a row, or a form submission, and return its generator
+        
+        The generator comes back with its schedule built, so the pay dates
+        are listed once per request.
+        
+        Args:
+            row: Submitted fields
+            allow_blank: Accept empty values, as the form always has; only
+                the salary, the period and the dates must then parse
+            payroll_data: Amounts already calculated for the row
+        
+        Raises:
+            ValueError: Why the input cannot be generated
+        """
+        annual_salary, pay_period = cls._check_row(row, allow_blank)
+        if payroll_data is None:
+            payroll_data = PayrollCalculator.calculate(annual_salary, pay_period)
+        generator = PayrollDocumentGenerator(row, payroll_data)
+        if not generator.get_periods():
+            raise ValueError("the date range holds no pay dates")
+        return generator
+    
+    @classmethod
+    def _check_row(cls, row: Dict[str, str], allow_blank: bool = False) -> Tuple[int, int]:
+        """
+        Check the fields of a row and return its (annual salary, pay period)
+        
+        Raises:
+            ValueError: For missing fields, numbers that do not parse or an
+                unsupported period
+        """
+        if allow_blank:
+            missing = [field for field in cls.REQUIRED_FIELDS if field not in row]
+        else:
+            missing = [field for field in cls.REQUIRED_FIELDS if not row.get(field)]
+        if missing:
+            raise ValueError(f"missing {', '.join(missing)}")
+        
+        annual_salary = int(row['anual'])
+        pay_period = int(row['period'])
+        # Checked first: the calculator divides by the period
+        check_frequency(pay_period)
+        return annual_salary, pay_period
 
 
 # Views
 PRODUCT_ID = settings.PRODUCT_ID
 
-def index(request):
-    """Main page with payment button - displays the checkout URL."""
+async def index(request):
+    """Main page with payment button; the checkout session is created on submit."""
     if request.method == 'GET':
-        # Create Stripe checkout session
-        checkout_session = create_stripe_checkout_session(PRODUCT_ID)
-        
-        # Create token linked to Stripe session
-        payment_token = PaymentToken.objects.create(
-            stripe_session_id=checkout_session.id
-        )
-
-        return render(request, 'index.html', {
-            'checkout_url': checkout_session.url,
-            'session_id': checkout_session.id
-        })
+        # No Stripe call and no database write until the visitor submits
+        return render(request, 'index.html')
 
     elif request.method == 'POST':
         client_email = request.POST.get('email')
-        session_id = request.POST.get('session_id')
 
-        if not session_id:
+        if not client_email:
             return redirect('index')
 
         try:
-            payment_token = PaymentToken.objects.get(stripe_session_id=session_id)
-            payment_token.customer_email = client_email
-            payment_token.save()
+            # Create Stripe checkout session
+            checkout_session = await create_stripe_checkout_session(PRODUCT_ID, client_email)
+
+            # Create token linked to Stripe session
+            await PaymentToken.objects.acreate(
+                stripe_session_id=checkout_session.id,
+                customer_email=client_email
+            )
 
-            checkout_session = stripe.checkout.Session.retrieve(session_id)
             return redirect(checkout_session.url)
 
-        except PaymentToken.DoesNotExist:
-            return redirect('index')
         except Exception as e:
             return HttpResponse(f"Error: {str(e)}", status=500)
 
     return HttpResponse("Invalid request method", status=405)
 
 
-def payment_success(request):
+async def payment_success(request):
     """View displayed when payment is successful."""
     if request.method == 'GET':
         return render(request, 'payments/success.html')
@@ -417,14 +840,16 @@ def payment_success(request):
     elif request.method == 'POST':
         email = request.POST.get('email')
 
-        token = PaymentToken.objects.filter(
-            customer_email=email,
-        ).first()
+        # Served by the (customer_email, is_paid, is_used, created_at) index
+        with span('token_query'):
+            token = await PaymentToken.usable().filter(
+                customer_email=email,
+            ).order_by('-created_at').values_list('token', flat=True).afirst()
 
-        if not token or not token.is_valid():
+        if not token:
             return redirect('index')
 
-        return redirect('payroll', token=token.token)
+        return redirect('payroll', token=token)
 
 
 def payment_cancel(request):
@@ -433,94 +858,277 @@ def payment_cancel(request):
 
 
 @csrf_exempt
-def payroll_view(request: HttpRequest, token: str) -> HttpResponse:
-
-    token_obj = get_object_or_404(PaymentToken, token=token)
-
-    if not token_obj or not token_obj.is_valid():
-        return redirect('index')
+async def payroll_view(request: HttpRequest, token: str) -> HttpResponse:
     """Main view for payroll generation."""
     if request.method == 'POST':
+        # One indexed lookup before any input is parsed, so a request
+        # without a usable token costs nothing
+        with span('token_query'):
+            usable = await _token_is_usable(token)
+        if not usable:
+            return redirect('index')
+
         try:
-            annual_salary = int(request.POST['anual'])
-            pay_period = int(request.POST['period'])
+            # Reject bad input and empty date ranges before the token is
+            # spent; the generator keeps the schedule built here
+            generator = BulkPayrollGenerator.generator_for(request.POST, allow_blank=True)
 
-            # Calculate payroll
-            payroll_data = PayrollCalculator.calculate(annual_salary, pay_period)
+            if settings.PAYROLL_ASYNC_JOBS:
+                # Queue the job for run_payroll_worker and answer right away
+                job = await sync_to_async(_submit_job)(
+                    token, request.POST.dict(), len(generator.get_periods())
+                )
+                if job is None:
+                    return redirect('index')
+                return JsonResponse({
+                    'job_id': str(job.id),
+                    'status_url': reverse('job_status', args=[job.id]),
+                }, status=202)
 
-            # Generate PDFs
-            generator = PayrollDocumentGenerator(request.POST, payroll_data)
+            # Wait a bounded time for a generation slot, before the token is spent
+            admission = get_admission_controller()
+            with span('admission_wait'):
+                admitted = await sync_to_async(admission.acquire, thread_sensitive=False)()
+            if not admitted:
+                return _saturated_response()
 
-            token = PaymentToken.objects.get(token=token)
-            token.mark_as_used()
+            try:
+                # One conditional UPDATE both checks and spends the token, so
+                # concurrent submissions cannot both pass
+                with span('token_query'):
+                    consumed = await PaymentToken.aconsume(token)
+                if not consumed:
+                    admission.release()
+                    return redirect('index')
 
-            return generator.generate_multiple_pdfs()
+                # Generate PDFs off the event loop
+                response = await sync_to_async(
+                    generator.generate_multiple_pdfs, thread_sensitive=False
+                )()
+            except BaseException:
+                admission.release()
+                raise
+
+            if response.streaming:
+                # A streamed archive is still being generated; keep the slot
+                response.streaming_content = _stream_body(
+                    request, admission.release_after(response.streaming_content)
+                )
+            else:
+                admission.release()
+            return response
 
         except (ValueError, KeyError) as e:
             return HttpResponse(f"Invalid input data: {str(e)}", status=400)
         except RuntimeError as e:
             return HttpResponse(f"Error generating PDFs: {str(e)}", status=500)
     else:
-        return render(request, 'payroll_view.html')
+        with span('token_query'):
+            token_obj = await PaymentToken.objects.only(
+                'id', 'token', 'is_paid', 'is_used', 'expires_at'
+            ).filter(token=token).afirst()
+        if token_obj is None:
+            raise Http404("No PaymentToken matches the given query.")
+        if not token_obj.is_valid():
+            return redirect('index')
+
+        return render(request, 'payroll_view.html', {'async_jobs': settings.PAYROLL_ASYNC_JOBS})
+
+
+async def _token_is_usable(token: str) -> bool:
+    """Whether a token is paid, unused and unexpired; not spent here"""
+    try:
+        token = uuid.UUID(token)
+    except ValueError:
+        return False
+    return await PaymentToken.usable().filter(token=token).aexists()
+
+
+def _submit_job(token: str, inputs: Dict, total: int) -> Optional[GenerationJob]:
+    """Spend the token and queue its generation job in one transaction"""
+    with transaction.atomic():
+        if not PaymentToken.consume(token):
+            return None
+        return GenerationJob.objects.create(
+            token_id=PaymentToken.objects.values_list('id', flat=True).get(token=token),
+            inputs=inputs,
+            total=total
+        )
+
+
+class _ThreadedStream:
+    """
+    Pull a blocking iterator from a worker thread, one chunk at a time
+
+    Under ASGI Django would otherwise read a sync streaming body to the end
+    before sending any of it. Django calls close() when the response ends.
+    """
+
+    def __init__(self, iterator: Iterable):
+        self._iterator = iter(iterator)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        done = object()
+        chunk = await sync_to_async(next, thread_sensitive=False)(self._iterator, done)
+        if chunk is done:
+            raise StopAsyncIteration
+        return chunk
+
+    def close(self):
+        if hasattr(self._iterator, 'close'):
+            self._iterator.close()
+
+
+def _stream_body(request: HttpRequest, iterator: Iterable) -> Iterable:
+    """
+    Hand a blocking streamed body to the server in the form it streams
+
+    ASGI consumes async iterators chunk by chunk, WSGI sync ones; given
+    the other kind, either server reads the whole body before sending it.
+    """
+    if isinstance(request, ASGIRequest):
+        return _ThreadedStream(iterator)
+    return iterator
+
+
+def _saturated_response() -> HttpResponse:
+    """Answer sent when no generation slot frees up in time"""
+    increment('payroll_admission_rejected_total')
+    response = HttpResponse("Too many payroll generations in progress; please retry shortly",
+                            status=503)
+    response['Retry-After'] = str(settings.PAYROLL_RETRY_AFTER)
+    return response
+
+
+@csrf_exempt
+def payroll_bulk_view(request: HttpRequest, token: str) -> HttpResponse:
+    """Generate the stubs of every employee in an uploaded CSV file"""
+    token_obj = get_object_or_404(
+        PaymentToken.objects.only('id', 'token', 'is_paid', 'is_used', 'expires_at'),
+        token=token
+    )
+
+    if not token_obj.is_valid():
+        return redirect('index')
+
+    if request.method != 'POST':
+        return render(request, 'payroll_bulk.html', {
+            'fields': BulkPayrollGenerator.REQUIRED_FIELDS + ['check_id'],
+        })
+
+    if 'employees' not in request.FILES:
+        return HttpResponse("Invalid input data: no CSV file uploaded", status=400)
+
+    # First pass: reject the whole file before any stub is generated
+    generator = BulkPayrollGenerator(request.FILES['employees'])
+    errors = generator.validate()
+    if errors:
+        return HttpResponse("Invalid input data:\n" + "\n".join(errors),
+                            status=400, content_type='text/plain')
+
+    admission = get_admission_controller()
+    if not admission.acquire():
+        return _saturated_response()
+
+    if not PaymentToken.consume(token):
+        admission.release()
+        return redirect('index')
+
+    # Second pass: read the rows again while the archive streams out
+    response = PayrollDocumentGenerator.create_streaming_zip_response(
+        generator.iter_pdfs(), filename='payroll_bulk.zip'
+    )
+    response.streaming_content = _stream_body(
+        request, admission.release_after(response.streaming_content)
+    )
+    return response
+
+
+def job_status(request: HttpRequest, job_id) -> JsonResponse:
+    """Report the progress of a generation job"""
+    job = get_object_or_404(GenerationJob, id=job_id)
+
+    data = {
+        'job_id': str(job.id),
+        'status': job.status,
+        'done': job.done,
+        'total': job.total,
+    }
+    if job.status == GenerationJob.DONE:
+        data['download_url'] = reverse('job_download', args=[job.id])
+    elif job.status == GenerationJob.FAILED:
+        data['error'] = job.error
+    return JsonResponse(data)
+
+
+def job_download(request: HttpRequest, job_id) -> FileResponse:
+    """Serve the archive, or the single PDF, of a finished generation job"""
+    job = get_object_or_404(GenerationJob, id=job_id, status=GenerationJob.DONE)
+
+    if not os.path.exists(job.result_path):
+        raise Http404("Archive no longer available")
+    if job.result_path.endswith('.pdf'):
+        return FileResponse(open(job.result_path, 'rb'), as_attachment=True,
+                            filename=PayrollDocumentGenerator.get_merged_name(job.inputs),
+                            content_type='application/pdf')
+    return FileResponse(open(job.result_path, 'rb'), as_attachment=True,
+                        filename='payroll_pdfs.zip', content_type='application/zip')
+
+
+def metrics(request: HttpRequest) -> HttpResponse:
+    """Expose the timing histograms and counters in the Prometheus text format"""
+    if not settings.PAYROLL_METRICS:
+        raise Http404("Metrics are disabled")
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 @csrf_exempt
 @require_POST
-def stripe_webhook(request):
+async def stripe_webhook(request):
     """Webhook for receiving Stripe events."""
     payload = request.body
     sig_header = request.META.get('HTTP_STRIPE_SIGNATURE')
 
     try:
-        event = stripe.Webhook.construct_event(
-            payload, sig_header, settings.STRIPE_WEBHOOK_SECRET
-        )
+        with span('stripe_webhook_verify'):
+            event = stripe.Webhook.construct_event(
+                payload, sig_header, settings.STRIPE_WEBHOOK_SECRET
+            )
     except ValueError:
         return HttpResponse(status=400)
     except stripe.error.SignatureVerificationError:
         return HttpResponse(status=400)
 
-    # Handle successful checkout event
-    if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-
-        try:
-            payment_token = PaymentToken.objects.get(
-                stripe_session_id=session['id']
-            )
-
-            if session['payment_status'] == 'paid':
-                payment_token.is_paid = True
-                payment_token.paid_at = timezone.now()
-                payment_token.stripe_payment_intent = session.get('payment_intent')
-
-                if session.get('customer_details', {}).get('email'):
-                    payment_token.customer_email = session['customer_details']['email']
-
-                payment_token.save()
-        except PaymentToken.DoesNotExist:
-            pass
+    # Stripe retries and replays carry the same event id; the unique
+    # insert rejects them without reading anything. The token update
+    # runs in the background once the event is acknowledged.
+    await sync_to_async(receive_event)(event)
 
     return HttpResponse(status=200)
 
 
 # Utility functions
 
-def create_stripe_checkout_session(price_id):
-    """Create a Stripe checkout session."""
+async def create_stripe_checkout_session(price_id, customer_email=None):
+    """Create a Stripe checkout session without blocking the event loop."""
     try:
-        checkout_session = stripe.checkout.Session.create(
-            line_items=[
-                {
-                    'price': price_id,
-                    'quantity': 1,
-                },
-            ],
-            mode='payment',
-            success_url=f"{settings.DOMAIN}/payment/success/",
-            cancel_url=f"{settings.DOMAIN}/payment/error/",
-            automatic_tax={'enabled': True}
-        )
+        with span('stripe_checkout'):
+            checkout_session = await stripe.checkout.Session.create_async(
+                line_items=[
+                    {
+                        'price': price_id,
+                        'quantity': 1,
+                    },
+                ],
+                mode='payment',
+                customer_email=customer_email,
+                success_url=f"{settings.DOMAIN}/payment/success/",
+                cancel_url=f"{settings.DOMAIN}/payment/error/",
+                automatic_tax={'enabled': True}
+            )
         return checkout_session
     except Exception as e:
         raise Exception(f"Unexpected error: {str(e)}")
@@ -0,0 +1,183 @@
+"""
+Stripe webhook event ledger and background processing
+"""
+
+# Standard library imports
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Optional
+
+# Third-party imports
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+
+# Local application imports
+from .models import PaymentToken, StripeEvent
+
+HANDLED_EVENTS = {'checkout.session.completed'}
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+_swept_at = None
+
+
+def record_event(event) -> Optional[StripeEvent]:
+    """
+    Insert an event into the ledger
+
+    Returns:
+        The new row, or None when the event was already received
+    """
+    handled = event['type'] in HANDLED_EVENTS
+    try:
+        with transaction.atomic():
+            return StripeEvent.objects.create(
+                event_id=event['id'],
+                type=event['type'],
+                payload=_session_fields(event['data']['object']) if handled else {},
+                # Events nothing acts on need no processing
+                processed_at=None if handled else timezone.now(),
+            )
+    except IntegrityError:
+        return None
+
+
+def receive_event(event):
+    """
+    Record an event and queue its processing; replays are ignored
+
+    Also queues a sweep of events whose processing failed for good, so
+    they are applied even where run_payroll_worker does not run.
+    """
+    stripe_event = record_event(event)
+    if stripe_event is not None:
+        dispatch(stripe_event)
+    _maybe_sweep()
+
+
+def dispatch(stripe_event: StripeEvent):
+    """Apply an event on the background executor once its row is committed"""
+    if stripe_event.processed_at is None:
+        transaction.on_commit(lambda: _get_executor().submit(_apply_in_background, stripe_event.pk))
+
+
+def apply_event(event_pk: int):
+    """Apply a recorded event to its token and mark it processed"""
+    stripe_event = StripeEvent.objects.get(pk=event_pk)
+    if stripe_event.processed_at is not None:
+        return
+
+    session = stripe_event.payload
+    if session['payment_status'] == 'paid':
+        changes = {'is_paid': True, 'paid_at': timezone.now()}
+        if session['email']:
+            changes['customer_email'] = session['email']
+        # A single UPDATE of the changed columns; no read of the token
+        PaymentToken.objects.filter(stripe_session_id=session['id']).update(**changes)
+
+    StripeEvent.objects.filter(pk=event_pk, processed_at__isnull=True).update(
+        processed_at=timezone.now()
+    )
+
+
+def process_pending_events(older_than: int = 60) -> int:
+    """
+    Apply events whose background update never ran, e.g. after a restart
+
+    Args:
+        older_than: Only events received at least this many seconds ago,
+            so events still queued in a web process are left alone
+
+    Returns:
+        Number of events applied
+    """
+    cutoff = timezone.now() - timedelta(seconds=older_than)
+    pending = list(
+        StripeEvent.objects.filter(processed_at__isnull=True, received_at__lt=cutoff)
+        .order_by('received_at').values_list('pk', flat=True)[:1000]
+    )
+    applied = 0
+    for event_pk in pending:
+        # One failing event must not hold back the ones after it
+        try:
+            apply_event(event_pk)
+        except Exception:
+            logger.exception("Stripe event %s failed again; still pending", event_pk)
+            continue
+        applied += 1
+    return applied
+
+
+def _session_fields(session) -> dict:
+    """The parts of a checkout session the token update needs"""
+    # Index access works for both plain dicts and StripeObject
+    customer_details = session['customer_details'] if 'customer_details' in session else None
+    return {
+        'id': session['id'],
+        'payment_status': session['payment_status'] if 'payment_status' in session else None,
+        'email': customer_details['email'] if customer_details and 'email' in customer_details else None,
+    }
+
+
+def _apply_in_background(event_pk: int):
+    """Executor task; retries with backoff, then leaves the event to the sweep"""
+    retries = settings.PAYROLL_WEBHOOK_RETRIES
+    for attempt in range(retries + 1):
+        close_old_connections()
+        try:
+            apply_event(event_pk)
+            return
+        except Exception:
+            if attempt == retries:
+                logger.exception(
+                    "Stripe event %s failed %d time(s); left for the pending event sweep",
+                    event_pk, attempt + 1
+                )
+                return
+            logger.warning("Stripe event %s failed; retrying", event_pk, exc_info=True)
+        finally:
+            close_old_connections()
+        time.sleep(settings.PAYROLL_WEBHOOK_RETRY_DELAY * 2 ** attempt)
+
+
+def _maybe_sweep():
+    """Queue process_pending_events at most once per sweep interval"""
+    global _swept_at
+
+    now = time.monotonic()
+    with _executor_lock:
+        if _swept_at is not None and now - _swept_at < settings.PAYROLL_WEBHOOK_SWEEP_INTERVAL:
+            return
+        _swept_at = now
+    transaction.on_commit(lambda: _get_executor().submit(_sweep_in_background))
+
+
+def _sweep_in_background():
+    """Executor task applying events the retries gave up on"""
+    close_old_connections()
+    try:
+        # Older than the whole retry schedule, so events still being
+        # retried here or in another process are left alone
+        retry_window = settings.PAYROLL_WEBHOOK_RETRY_DELAY * 2 ** (settings.PAYROLL_WEBHOOK_RETRIES + 1)
+        applied = process_pending_events(older_than=int(retry_window) + 60)
+        if applied:
+            logger.info("Applied %d pending Stripe event(s)", applied)
+    except Exception:
+        logger.exception("Pending Stripe event sweep failed")
+    finally:
+        close_old_connections()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.PAYROLL_WEBHOOK_WORKERS)
+        return _executor
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
 
 application = get_asgi_application()
+
+# Server processes only: start the resident LibreOffice workers, if enabled
+from payroll.converters import prewarm  # noqa: E402
+
+prewarm()
@@ -46,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'payroll.metrics.TimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -145,4 +146,87 @@ LOCALE_PATHS = [
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
 DOMAIN = os.getenv('DOMAIN')
 STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
-PRODUCT_ID = os.getenv('PRODUCT_ID')
\ No newline at end of file
+PRODUCT_ID = os.getenv('PRODUCT_ID')
+# Override to point the Stripe client at a local stub of the API
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE')
+
+# Payroll document generation
+PAYROLL_LIBREOFFICE_BIN = os.getenv('PAYROLL_LIBREOFFICE_BIN', 'libreoffice')
+# 'subprocess' starts LibreOffice per document, 'pool' keeps resident workers,
+# 'fake' writes placeholder PDFs without LibreOffice (benchmarks, development)
+PAYROLL_CONVERTER = os.getenv('PAYROLL_CONVERTER', 'subprocess')
+PAYROLL_CONVERTER_POOL_SIZE = int(os.getenv('PAYROLL_CONVERTER_POOL_SIZE', '2'))
+PAYROLL_CONVERTER_TIMEOUT = int(os.getenv('PAYROLL_CONVERTER_TIMEOUT', '60'))
+PAYROLL_CONVERTER_MAX_JOBS = int(os.getenv('PAYROLL_CONVERTER_MAX_JOBS', '200'))
+PAYROLL_CONVERTER_PREWARM = os.getenv('PAYROLL_CONVERTER_PREWARM', 'True') == 'True'
+# Render every stub of a request first, then convert them in one batch
+PAYROLL_BATCH_CONVERSION = os.getenv('PAYROLL_BATCH_CONVERSION', 'True') == 'True'
+# 'libreoffice' fills base.docx and converts it, 'native' draws the PDF in-process
+PAYROLL_RENDER_BACKEND = os.getenv('PAYROLL_RENDER_BACKEND', 'libreoffice')
+# Stubs of one request are generated on a shared pool of this many workers
+PAYROLL_PARALLEL_WORKERS = int(os.getenv('PAYROLL_PARALLEL_WORKERS', str(os.cpu_count() or 1)))
+# 'thread' or 'process'
+PAYROLL_PARALLEL_EXECUTOR = os.getenv('PAYROLL_PARALLEL_EXECUTOR', 'thread')
+# Parent of the private per-request scratch directories, e.g. a tmpfs such as
+# /dev/shm; defaults to the system temp directory
+PAYROLL_SCRATCH_DIR = os.getenv('PAYROLL_SCRATCH_DIR') or None
+# Stream the ZIP while stubs are still being generated
+PAYROLL_STREAM_ZIP = os.getenv('PAYROLL_STREAM_ZIP', 'False') == 'True'
+# 'stored' or 'deflated'; PDFs are already compressed, so storing is cheapest
+PAYROLL_ZIP_COMPRESSION = os.getenv('PAYROLL_ZIP_COMPRESSION', 'stored')
+PAYROLL_ZIP_COMPRESSLEVEL = int(os.getenv('PAYROLL_ZIP_COMPRESSLEVEL', '6'))
+# Queue generation for run_payroll_worker instead of generating in the request
+PAYROLL_ASYNC_JOBS = os.getenv('PAYROLL_ASYNC_JOBS', 'False') == 'True'
+PAYROLL_JOB_RESULTS_DIR = os.getenv('PAYROLL_JOB_RESULTS_DIR', str(BASE_DIR / 'payroll_jobs'))
+PAYROLL_JOB_POLL_INTERVAL = float(os.getenv('PAYROLL_JOB_POLL_INTERVAL', '1'))
+# Running jobs older than this many seconds are assumed lost and queued again
+PAYROLL_JOB_STALE_AFTER = int(os.getenv('PAYROLL_JOB_STALE_AFTER', '3600'))
+# Keep rendered stubs on disk, keyed by a hash of their inputs, the template
+# and the renderer. Stubs hold names, addresses, SSN digits and salaries, so
+# the cache is off unless enabled with a private directory below.
+PAYROLL_STUB_CACHE = os.getenv('PAYROLL_STUB_CACHE', 'False') == 'True'
+# Required when the cache is on; created readable by this user only
+PAYROLL_STUB_CACHE_DIR = os.getenv('PAYROLL_STUB_CACHE_DIR') or None
+PAYROLL_STUB_CACHE_MAX_BYTES = int(os.getenv('PAYROLL_STUB_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+# Largest CSV accepted by the bulk payroll run
+PAYROLL_BULK_MAX_ROWS = int(os.getenv('PAYROLL_BULK_MAX_ROWS', '1000'))
+# Default download: 'zip' holds one PDF per period, 'merged' one PDF with a
+# page per period; the form's 'output' field overrides it
+PAYROLL_OUTPUT = os.getenv('PAYROLL_OUTPUT', 'zip')
+# purge_expired_tokens keeps tokens this many days past their expiry
+PAYROLL_TOKEN_RETENTION_DAYS = int(os.getenv('PAYROLL_TOKEN_RETENTION_DAYS', '7'))
+# Threads applying Stripe webhook events after they are acknowledged
+PAYROLL_WEBHOOK_WORKERS = int(os.getenv('PAYROLL_WEBHOOK_WORKERS', '2'))
+# A failed background update is retried this many times, waiting
+# PAYROLL_WEBHOOK_RETRY_DELAY seconds and doubling the wait each time
+PAYROLL_WEBHOOK_RETRIES = int(os.getenv('PAYROLL_WEBHOOK_RETRIES', '5'))
+PAYROLL_WEBHOOK_RETRY_DELAY = float(os.getenv('PAYROLL_WEBHOOK_RETRY_DELAY', '1'))
+# Every incoming webhook also applies events left unprocessed, at most
+# once per this many seconds per process
+PAYROLL_WEBHOOK_SWEEP_INTERVAL = int(os.getenv('PAYROLL_WEBHOOK_SWEEP_INTERVAL', '60'))
+# Admission control: generations running at once per process, how long a
+# request waits for a slot before a 503, and the Retry-After it gets
+PAYROLL_MAX_CONCURRENT_GENERATIONS = int(os.getenv('PAYROLL_MAX_CONCURRENT_GENERATIONS', '4'))
+PAYROLL_ADMISSION_WAIT = float(os.getenv('PAYROLL_ADMISSION_WAIT', '5'))
+PAYROLL_RETRY_AFTER = int(os.getenv('PAYROLL_RETRY_AFTER', '30'))
+# Largest number of pay periods one request may generate
+PAYROLL_MAX_PERIODS = int(os.getenv('PAYROLL_MAX_PERIODS', '120'))
+# Time each generation stage, Stripe call and token query, exposed at /metrics/
+PAYROLL_METRICS = os.getenv('PAYROLL_METRICS', 'False') == 'True'
+# Shared directory where every process leaves its metrics, so one scrape
+# covers all workers; unset reports only the process that answers
+PAYROLL_METRICS_DIR = os.getenv('PAYROLL_METRICS_DIR') or None
+PAYROLL_METRICS_FLUSH_INTERVAL = float(os.getenv('PAYROLL_METRICS_FLUSH_INTERVAL', '1'))
+# Log one JSON line per request with the time spent in each stage
+PAYROLL_TIMING_LOG = os.getenv('PAYROLL_TIMING_LOG', 'False') == 'True'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'payroll.timing': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
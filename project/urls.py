@@ -19,8 +19,12 @@ from payroll import views
 
 urlpatterns = [
     path('', views.index, name='index'),
+    path('payroll/jobs/<uuid:job_id>/', views.job_status, name='job_status'),
+    path('payroll/jobs/<uuid:job_id>/download/', views.job_download, name='job_download'),
     path('payroll/<str:token>/', views.payroll_view, name='payroll'),
+    path('payroll/<str:token>/bulk/', views.payroll_bulk_view, name='payroll_bulk'),
     path('payment/cancel/', views.payment_cancel, name='payment_cancel'),
     path('webhook/stripe/', views.stripe_webhook, name='stripe_webhook'),
     path('payment/success/', views.payment_success, name='payment_success'),
+    path('metrics/', views.metrics, name='metrics'),
 ]